@@ -1,13 +1,45 @@
-from flask import Flask, render_template, request, redirect, session
-from db_connection import get_connection
-from detection.realtime import run_camera_detection
-from detection.video_detect import detect_video
+from flask import (
+    Flask,
+    Response,
+    g,
+    send_file,
+    render_template,
+    request,
+    redirect,
+    session,
+    jsonify,
+)
+from db_connection import db_cursor
+from streams import start_engine, stop_engine, get_engine
+from jobs import enqueue_job, get_job_status, start_worker_pool
 from notification import validate_phone_number
-from notification_email import send_violation_email
-from ultralytics import YOLO
+from notification_email import notify_violation
+from model_registry import get_batcher, load_all
+from association import associate
+from records import fetch_page, parse_filters
+from rollups import add_to_rollups, dashboard_summary
+from result_cache import cache_key, get_result_cache
+from metrics import (
+    HTTP_REQUESTS,
+    HTTP_SECONDS,
+    clear_snapshots,
+    render as render_metrics,
+)
+from overlay import ensure_overlay
+from thumbnails import (
+    THUMBNAIL_FOLDERS,
+    content_etag,
+    ensure_thumbnail,
+    is_thumbnail,
+    make_thumbnail,
+)
 import os
+import time
+import uuid
 import cv2
+import numpy as np
 from datetime import datetime
+from urllib.parse import urlencode
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -22,6 +54,10 @@ app.secret_key = "helmettrack_secret"
 ADMIN_EMAIL = os.environ.get("ADMIN_EMAIL", "22r91a1235@tkrec.ac.in")
 SEND_EMAIL_ENABLED = os.environ.get("SEND_EMAIL_ENABLED", "True").lower() == "true"
 
+# Video job workers started alongside the web server (0 = run
+# `python jobs.py worker` separately, e.g. on other hosts)
+JOB_LOCAL_WORKERS = int(os.environ.get("JOB_LOCAL_WORKERS", "1"))
+
 # -------------------------
 # DIRECTORIES
 # -------------------------
@@ -33,6 +69,34 @@ VIOLATION_FOLDER = os.path.join(BASE_DIR, "static", "violations")
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(VIOLATION_FOLDER, exist_ok=True)
 
+# Browser cache lifetime of violation thumbnails (never change once written)
+THUMBNAIL_MAX_AGE = int(os.environ.get("THUMBNAIL_MAX_AGE", "31536000"))
+
+
+# -------------------------
+# METRICS
+# -------------------------
+@app.before_request
+def _start_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def _record_request(response):
+    start = g.pop("request_start", None)
+    if start is not None:
+        # Streaming responses are timed until their headers are ready
+        endpoint = request.endpoint or "unknown"
+        HTTP_SECONDS.observe(endpoint, value=time.perf_counter() - start)
+        HTTP_REQUESTS.inc(endpoint, response.status_code)
+    return response
+
+
+@app.route("/metrics")
+def metrics():
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+
 # -------------------------
 # ROUTES
 # -------------------------
@@ -48,12 +112,12 @@ def login():
     username = request.form["username"]
     password = request.form["password"]
 
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT * FROM admin WHERE username=%s AND password=%s", (username, password)
-    )
-    admin = cursor.fetchone()
+    with db_cursor() as cursor:
+        cursor.execute(
+            "SELECT * FROM admin WHERE username=%s AND password=%s",
+            (username, password),
+        )
+        admin = cursor.fetchone()
 
     if admin:
         session["admin"] = username
@@ -65,7 +129,13 @@ def login():
 def dashboard():
     if "admin" not in session:
         return redirect("/")
-    return render_template("dashboard.html")
+    # Rollup tables only: a few hundred rows whatever the history size
+    try:
+        summary = dashboard_summary()
+    except Exception as e:
+        print(f"Dashboard summary error: {e}")
+        summary = None
+    return render_template("dashboard.html", summary=summary)
 
 
 # -------------------------
@@ -94,32 +164,25 @@ def add_user():
         photo_path = os.path.join(UPLOAD_FOLDER, photo_name)
         photo.save(photo_path)
 
-        conn = get_connection()
-        cursor = conn.cursor()
         try:
-            cursor.execute(
-                "INSERT INTO users (name, photo, aadhar_no, phone_number) VALUES (%s, %s, %s, %s)",
-                (name, photo_name, aadhar, formatted_phone),
-            )
-            conn.commit()
+            with db_cursor(commit=True) as cursor:
+                cursor.execute(
+                    "INSERT INTO users (name, photo, aadhar_no, phone_number) VALUES (%s, %s, %s, %s)",
+                    (name, photo_name, aadhar, formatted_phone),
+                )
             return redirect("/view_users")
         except Exception as e:
-            conn.rollback()
             print(f"Database error: {e}")
             return f"Error adding user: {str(e)}", 500
-        finally:
-            cursor.close()
-            conn.close()
 
     return render_template("add_user.html")
 
 
 @app.route("/view_users")
 def view_users():
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM users")
-    users = cursor.fetchall()
+    with db_cursor() as cursor:
+        cursor.execute("SELECT * FROM users")
+        users = cursor.fetchall()
     return render_template("view_users.html", users=users)
 
 
@@ -133,11 +196,28 @@ def upload_video():
 
     # POST: process video
     video = request.files["video"]
-    save_path = os.path.join(UPLOAD_FOLDER, video.filename)
+    # Unique name: an upload with the same filename must not replace a
+    # video that is still waiting for its job
+    extension = os.path.splitext(video.filename)[1]
+    save_path = os.path.join(UPLOAD_FOLDER, f"{uuid.uuid4().hex}{extension}")
     video.save(save_path)
 
-    detect_video(save_path)
-    return "Video processed successfully!"
+    # Processed by a job worker; poll /jobs/<id> for progress
+    job_id = enqueue_job(save_path)
+    return (
+        jsonify(
+            {"job_id": job_id, "status": "queued", "status_url": f"/jobs/{job_id}"}
+        ),
+        202,
+    )
+
+
+@app.route("/jobs/<int:job_id>")
+def job_status(job_id):
+    job = get_job_status(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
 
 
 # -------------------------
@@ -145,16 +225,89 @@ def upload_video():
 # -------------------------
 @app.route("/no_helmet_records")
 def violations():
-    conn = get_connection()
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute(
-        "SELECT id, timestamp, image_name, original_image, violation_image, fine_amount "
-        "FROM no_helmet_records ORDER BY timestamp DESC"
+    try:
+        filters = parse_filters(request.args)
+    except ValueError as e:
+        return f"Invalid filter: {e}", 400
+    data, next_cursor = fetch_page(**filters)
+
+    # JSON variant of the same page: /no_helmet_records?format=json
+    if request.args.get("format") == "json":
+        for row in data:
+            row["timestamp"] = row["timestamp"].strftime("%Y-%m-%d %H:%M:%S")
+        return jsonify({"records": data, "next_cursor": next_cursor})
+
+    # Filters are kept on the "next page" link, only the cursor changes
+    query = {k: v for k, v in request.args.items() if k != "cursor" and v}
+    first_url = (
+        "/no_helmet_records?" + urlencode(query) if "cursor" in request.args else None
     )
-    data = cursor.fetchall()
-    cursor.close()
-    conn.close()
-    return render_template("no_helmet_records.html", records=data)
+    next_url = None
+    if next_cursor:
+        next_url = "/no_helmet_records?" + urlencode(dict(query, cursor=next_cursor))
+    return render_template(
+        "no_helmet_records.html",
+        records=data,
+        filters=request.args,
+        first_url=first_url,
+        next_url=next_url,
+        json_url="/no_helmet_records?" + urlencode(dict(request.args, format="json")),
+    )
+
+
+# -------------------------
+# THUMBNAILS
+# -------------------------
+@app.route("/thumbs/<folder>/<path:filename>")
+def thumbnail(folder, filename):
+    base = THUMBNAIL_FOLDERS.get(folder)
+    if base is None or is_thumbnail(filename):
+        return "Not found", 404
+    image_path = os.path.join(base, filename)
+    if os.path.dirname(os.path.abspath(image_path)) != os.path.abspath(base):
+        return "Not found", 404
+
+    # Older images get their thumbnail on first request
+    path = ensure_thumbnail(image_path)
+    if path is None:
+        return "Not found", 404
+
+    etag = content_etag(path)
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = send_file(path, mimetype="image/jpeg", etag=False)
+    response.set_etag(etag)
+    response.cache_control.no_cache = None
+    response.cache_control.public = True
+    if folder == "violations":
+        response.cache_control.max_age = THUMBNAIL_MAX_AGE
+    else:
+        # Uploads keep their original filename and can be replaced,
+        # so browsers revalidate (a cheap 304 when unchanged)
+        response.cache_control.no_cache = True
+    return response
+
+
+@app.route("/overlay/violations/<filename>")
+def violation_overlay(filename):
+    # Annotated view of a violation, rendered from its sidecar on first
+    # request when it was stored as a clean frame (DETECTIONS_ONLY)
+    image_path = os.path.join(VIOLATION_FOLDER, os.path.basename(filename))
+    path = ensure_overlay(image_path)
+    if path is None:
+        return "Not found", 404
+
+    etag = content_etag(path)
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = send_file(path, mimetype="image/jpeg", etag=False)
+    response.set_etag(etag)
+    response.cache_control.no_cache = None
+    response.cache_control.public = True
+    response.cache_control.max_age = THUMBNAIL_MAX_AGE
+    return response
 
 
 # -------------------------
@@ -169,103 +322,77 @@ def prediction_page():
 def predict_image():
 
     img = request.files["image"]
-    save_path = os.path.join(UPLOAD_FOLDER, img.filename)
-    img.save(save_path)
-
-    # Load models
-    pb_model = YOLO("yolov8n.pt")  # person + bike
-    helmet_model = YOLO("yolov8/best.pt")  # helmet
-
-    image = cv2.imread(save_path)
-
-    pb_results = pb_model(image)
-    helmet_results = helmet_model(image)
+    data = img.read()
+    output_path = os.path.join(UPLOAD_FOLDER, "output.jpg")
 
-    persons = []
-    bikes = []
-    no_helmets = []
+    # Same image + same models: reuse the earlier result, skip inference
+    # (its violations were already recorded the first time)
+    key = cache_key(data)
+    cached = get_result_cache().get(key)
+    if cached is not None:
+        with open(output_path, "wb") as f:
+            f.write(cached[1])
+        return render_template("show_result.html", image="output.jpg")
 
-    # -------------------------
-    # PERSON + BIKE DETECTION
-    # -------------------------
-    for box in pb_results[0].boxes:
-        cls = int(box.cls[0])
-        label = pb_model.names[cls]
-        x1, y1, x2, y2 = map(int, box.xyxy[0])
-
-        if label == "person":
-            persons.append((x1, y1, x2, y2))
-        elif label in ["motorcycle", "bicycle"]:
-            bikes.append((x1, y1, x2, y2))
+    save_path = os.path.join(UPLOAD_FOLDER, img.filename)
+    with open(save_path, "wb") as f:
+        f.write(data)
 
-    # -------------------------
-    # NO HELMET DETECTION
-    # -------------------------
-    for box in helmet_results[0].boxes:
-        cls = int(box.cls[0])
-        label = helmet_model.names[cls].lower()
-        conf = float(box.conf[0])
+    image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        return "Could not read the uploaded image", 400
+    make_thumbnail(save_path, image)
 
-        if "without helmet" in label:
-            x1, y1, x2, y2 = map(int, box.xyxy[0])
-            no_helmets.append((x1, y1, x2, y2, conf))
+    # Batched together with other concurrent uploads
+    persons, bikes, no_helmets = get_batcher().predict(image)
 
     # -------------------------
     # VIOLATION LOGIC
     # -------------------------
-    for nhx1, nhy1, nhx2, nhy2, conf in no_helmets:
-        nh_cx = (nhx1 + nhx2) // 2
-        nh_cy = (nhy1 + nhy2) // 2
-
-        for px1, py1, px2, py2 in persons:
-            if px1 <= nh_cx <= px2 and py1 <= nh_cy <= py2:
-
-                person_cx = (px1 + px2) // 2
-                person_cy = (py1 + py2) // 2
-
-                for bx1, by1, bx2, by2 in bikes:
-                    if bx1 <= person_cx <= bx2 and by1 <= person_cy <= by2:
-
-                        # 🚨 VIOLATION CONFIRMED
-                        cv2.rectangle(image, (px1, py1), (px2, py2), (0, 0, 255), 3)
-                        cv2.putText(
-                            image,
-                            "NO HELMET",
-                            (px1, py1 - 10),
-                            cv2.FONT_HERSHEY_SIMPLEX,
-                            0.8,
-                            (0, 0, 255),
-                            2,
-                        )
-
-                        viol_name = (
-                            f"viol_{datetime.now().strftime('%Y%m%d%H%M%S%f')}.jpg"
-                        )
-                        viol_path = os.path.join(VIOLATION_FOLDER, viol_name)
-                        cv2.imwrite(viol_path, image)
-
-                        conn = get_connection()
-                        cursor = conn.cursor()
-                        cursor.execute(
-                            "INSERT INTO no_helmet_records "
-                            "(image_name, original_image, violation_image, fine_amount, timestamp) "
-                            "VALUES (%s, %s, %s, %s, NOW())",
-                            (img.filename, img.filename, viol_name, 500),
-                        )
-                        conn.commit()
-                        cursor.close()
-                        conn.close()
-
-                        # Send email notification
-                        violation_details = {
-                            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                            "fine_amount": 500,
-                            "image": viol_name,
-                        }
-                        send_violation_email(ADMIN_EMAIL, violation_details)
-
-    output_path = os.path.join(UPLOAD_FOLDER, "output.jpg")
-    cv2.imwrite(output_path, image)
+    for violation in associate(persons, bikes, no_helmets, min_person_conf=0.0):
+        px1, py1, px2, py2 = violation["person"]
+
+        # 🚨 VIOLATION CONFIRMED
+        cv2.rectangle(image, (px1, py1), (px2, py2), (0, 0, 255), 3)
+        cv2.putText(
+            image,
+            "NO HELMET",
+            (px1, py1 - 10),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            0.8,
+            (0, 0, 255),
+            2,
+        )
+
+        viol_name = f"viol_{datetime.now().strftime('%Y%m%d%H%M%S%f')}.jpg"
+        viol_path = os.path.join(VIOLATION_FOLDER, viol_name)
+        cv2.imwrite(viol_path, image)
+        make_thumbnail(viol_path, image)
+
+        detected_at = datetime.now()
+        with db_cursor(commit=True) as cursor:
+            cursor.execute(
+                "INSERT INTO no_helmet_records "
+                "(image_name, original_image, violation_image, fine_amount, timestamp, source) "
+                "VALUES (%s, %s, %s, %s, %s, %s)",
+                (img.filename, img.filename, viol_name, 500, detected_at, "image"),
+            )
+            add_to_rollups(cursor, [(detected_at, "image", 500)])
+
+        # Email the admin (or queue for the digest)
+        violation_details = {
+            "timestamp": detected_at.strftime("%Y-%m-%d %H:%M:%S"),
+            "fine_amount": 500,
+            "image": viol_name,
+        }
+        notify_violation(ADMIN_EMAIL, violation_details, viol_path)
+
+    # Encoded once, for the response and the cache
+    ok, encoded = cv2.imencode(".jpg", image)
+    if ok:
+        with open(output_path, "wb") as f:
+            f.write(encoded.tobytes())
+        get_result_cache().put(key, (persons, bikes, no_helmets), encoded.tobytes())
 
     return render_template("show_result.html", image="output.jpg")
 
@@ -275,8 +402,34 @@ def predict_image():
 # -------------------------
 @app.route("/start_camera")
 def start_camera():
-    run_camera_detection()
-    return "Camera closed"
+    # Headless: detection runs on the engine's threads (STREAM_SOURCES)
+    return jsonify(start_engine().status())
+
+
+@app.route("/stop_camera")
+def stop_camera():
+    stop_engine()
+    return jsonify({"running": False})
+
+
+@app.route("/camera_status")
+def camera_status():
+    engine = get_engine()
+    if engine is None:
+        return jsonify({"running": False, "streams": []})
+    return jsonify(engine.status())
+
+
+@app.route("/video_feed/<int:camera>")
+def video_feed(camera):
+    # Live MJPEG view of a camera's annotated frames (usable as <img src>)
+    engine = get_engine()
+    if engine is None or not 0 <= camera < len(engine.streams):
+        return "Camera not running", 404
+    return Response(
+        engine.streams[camera].broadcaster.mjpeg(),
+        mimetype="multipart/x-mixed-replace; boundary=frame",
+    )
 
 
 # -------------------------
@@ -292,4 +445,9 @@ def logout():
 # RUN APP
 # -------------------------
 if __name__ == "__main__":
+    load_all()
+    if JOB_LOCAL_WORKERS > 0 and os.environ.get("WERKZEUG_RUN_MAIN") != "true":
+        # Drop metric snapshots of workers from earlier runs
+        clear_snapshots()
+        start_worker_pool(JOB_LOCAL_WORKERS)
     app.run(debug=True)
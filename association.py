@@ -0,0 +1,167 @@
+"""
+Detection Association
+Decodes YOLO results into NumPy box arrays in one pass and applies the
+violation rule (no-helmet box inside a person who is inside a bike) to all
+no-helmet / person / bike combinations at once with broadcasting.
+"""
+
+from collections import namedtuple
+import numpy as np
+
+PERSON = 1
+BIKE = 2
+NO_HELMET = 3
+
+PERSON_KEYWORDS = ("person",)
+BIKE_KEYWORDS = ("motorbike", "motorcycle", "bicycle", "bike")
+NO_HELMET_KEYWORDS = ("without helmet", "no helmet")
+
+# Minimum person confidence for a violation in video / realtime detection
+MIN_PERSON_CONF = 0.5
+
+# xyxy: (N, 4) int32 array, conf: (N,) float32 array
+Boxes = namedtuple("Boxes", ["xyxy", "conf"])
+
+_group_tables = {}
+
+
+def empty_boxes():
+    return Boxes(np.zeros((0, 4), dtype=np.int32), np.zeros(0, dtype=np.float32))
+
+
+def _label_group(label):
+    label = label.lower()
+    if any(k in label for k in PERSON_KEYWORDS):
+        return PERSON
+    if any(k in label for k in BIKE_KEYWORDS):
+        return BIKE
+    if any(k in label for k in NO_HELMET_KEYWORDS):
+        return NO_HELMET
+    return 0
+
+
+def _group_table(names):
+    # names is the model's {class_id: label} dict; build the lookup once
+    key = id(names)
+    table = _group_tables.get(key)
+    if table is None:
+        size = max(names) + 1 if names else 0
+        table = np.zeros(size, dtype=np.int8)
+        for cls, label in names.items():
+            table[cls] = _label_group(label)
+        _group_tables[key] = table
+    return table
+
+
+def _to_numpy(values):
+    if hasattr(values, "cpu"):
+        values = values.cpu()
+    if hasattr(values, "numpy"):
+        return values.numpy()
+    return np.asarray(values)
+
+
+def decode(result, names, offset=(0, 0)):
+    """
+    Split a YOLO result into person, bike and no-helmet boxes
+
+    Args:
+        result: ultralytics Results object
+        names (dict): Model class names
+        offset (tuple): (x, y) added to every box (crop to frame mapping)
+
+    Returns:
+        dict: {PERSON: Boxes, BIKE: Boxes, NO_HELMET: Boxes}
+    """
+    boxes = result.boxes
+    xyxy = _to_numpy(boxes.xyxy).reshape(-1, 4).astype(np.int32)
+    conf = _to_numpy(boxes.conf).reshape(-1).astype(np.float32)
+    groups = _group_table(names)[_to_numpy(boxes.cls).reshape(-1).astype(np.intp)]
+
+    if offset != (0, 0):
+        xyxy += np.array(offset * 2, dtype=np.int32)
+
+    return {
+        group: Boxes(xyxy[groups == group], conf[groups == group])
+        for group in (PERSON, BIKE, NO_HELMET)
+    }
+
+
+def concat_boxes(parts):
+    """
+    Join several Boxes, dropping exact duplicates (first occurrence wins)
+    """
+    parts = [p for p in parts if len(p.xyxy)]
+    if not parts:
+        return empty_boxes()
+    xyxy = np.concatenate([p.xyxy for p in parts])
+    conf = np.concatenate([p.conf for p in parts])
+    _, keep = np.unique(xyxy, axis=0, return_index=True)
+    keep.sort()
+    return Boxes(xyxy[keep], conf[keep])
+
+
+def centers(xyxy):
+    return (xyxy[:, :2] + xyxy[:, 2:]) // 2
+
+
+def points_in_boxes(points, xyxy):
+    """
+    Returns:
+        numpy.ndarray: (len(points), len(xyxy)) bool matrix, True where the
+        point lies inside the box (edges included)
+    """
+    px = points[:, None, 0]
+    py = points[:, None, 1]
+    return (
+        (xyxy[None, :, 0] <= px)
+        & (px <= xyxy[None, :, 2])
+        & (xyxy[None, :, 1] <= py)
+        & (py <= xyxy[None, :, 3])
+    )
+
+
+def rider_mask(persons, bikes):
+    """
+    Returns:
+        numpy.ndarray: bool per person, True if its center is inside a bike
+    """
+    if not len(persons.xyxy) or not len(bikes.xyxy):
+        return np.zeros(len(persons.xyxy), dtype=bool)
+    return points_in_boxes(centers(persons.xyxy), bikes.xyxy).any(axis=1)
+
+
+def associate(persons, bikes, no_helmets, min_person_conf=MIN_PERSON_CONF):
+    """
+    Find no-helmet boxes whose center is inside a person whose center is
+    inside a bike
+
+    Args:
+        persons, bikes, no_helmets (Boxes): Detections for one frame
+        min_person_conf (float): Persons at or below this are ignored
+
+    Returns:
+        list: One dict per (no-helmet, person) pair, ordered by no-helmet box
+            then person, with keys no_helmet, person, bike (xyxy tuples),
+            conf (no-helmet confidence) and person_conf
+    """
+    if not len(no_helmets.xyxy) or not len(persons.xyxy) or not len(bikes.xyxy):
+        return []
+
+    on_bike = points_in_boxes(centers(persons.xyxy), bikes.xyxy)
+    riding = on_bike.any(axis=1) & (persons.conf > min_person_conf)
+    pairs = points_in_boxes(centers(no_helmets.xyxy), persons.xyxy) & riding
+
+    nh_idx, p_idx = np.nonzero(pairs)
+    bike_idx = on_bike[p_idx].argmax(axis=1)
+
+    return [
+        {
+            "no_helmet": tuple(int(v) for v in no_helmets.xyxy[n]),
+            "person": tuple(int(v) for v in persons.xyxy[p]),
+            "bike": tuple(int(v) for v in bikes.xyxy[b]),
+            "conf": float(no_helmets.conf[n]),
+            "person_conf": float(persons.conf[p]),
+        }
+        for n, p, b in zip(nh_idx, p_idx, bike_idx)
+    ]
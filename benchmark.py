@@ -0,0 +1,448 @@
+"""
+Pipeline Benchmark
+Feeds a recorded or synthetic video through the detection pipeline and
+reports per-stage latency percentiles and throughput:
+
+    decode, pb_inference, helmet_inference, association, drawing,
+    tracking, image_encode, sink_db, sink_email
+
+--stub-models replaces both YOLO models with fixed-cost fakes so the
+non-model stages can be measured on any machine without weights or a GPU.
+Results are written as JSON so runs before and after a change can be
+compared.
+
+The per-stage mode runs its own sequential copy of the detection loop so
+each stage can be timed on its own; it does not include the decode /
+inference / annotate pipelining, ROI cropping or motion gating of
+video_detect.detect_video. --end-to-end runs detect_video itself (model
+calls and overall FPS are measured, the other stages overlap and are not
+reported separately) so those changes can be compared too.
+
+Usage:
+    python benchmark.py --stub-models --frames 300 --output before.json
+    python benchmark.py --stub-models --end-to-end --output pipeline.json
+    python benchmark.py --video clip.mp4 --batch-size 8 --output after.json
+    MODEL_BACKEND=openvino python benchmark.py --video clip.mp4 --output ov.json
+"""
+
+from collections import defaultdict
+from datetime import datetime
+import subprocess
+import platform
+import tempfile
+import argparse
+import json
+import time
+import cv2
+import numpy as np
+import os
+
+STAGES = (
+    "decode",
+    "pb_inference",
+    "helmet_inference",
+    "association",
+    "drawing",
+    "tracking",
+    "image_encode",
+    "sink_db",
+    "sink_email",
+)
+
+
+class StageTimer:
+    """
+    Collects per-call durations and item counts for each stage
+    """
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.items = defaultdict(int)
+
+    def record(self, stage, seconds, items=1):
+        self.samples[stage].append(seconds)
+        self.items[stage] += items
+
+    def time(self, stage, fn, *args, items=1, **kwargs):
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        self.record(stage, time.perf_counter() - start, items)
+        return result
+
+    def report(self):
+        """
+        Returns:
+            dict: {stage: calls, items, total / mean / p50 / p90 / p99 / max
+                (ms per call) and throughput (items per second)}
+        """
+        report = {}
+        for stage in STAGES:
+            samples = self.samples.get(stage)
+            if not samples:
+                continue
+            ms = np.array(samples) * 1000.0
+            total = float(ms.sum())
+            report[stage] = {
+                "calls": len(samples),
+                "items": self.items[stage],
+                "total_ms": round(total, 3),
+                "mean_ms": round(float(ms.mean()), 3),
+                "p50_ms": round(float(np.percentile(ms, 50)), 3),
+                "p90_ms": round(float(np.percentile(ms, 90)), 3),
+                "p99_ms": round(float(np.percentile(ms, 99)), 3),
+                "max_ms": round(float(ms.max()), 3),
+                "throughput_per_s": (
+                    round(self.items[stage] / (total / 1000.0), 2) if total else None
+                ),
+            }
+        return report
+
+
+# -------------------------
+# STUB MODELS
+# -------------------------
+class _StubBoxes:
+    def __init__(self, rows):
+        rows = np.array(rows, dtype=np.float32).reshape(-1, 6)
+        self.xyxy = rows[:, :4]
+        self.conf = rows[:, 4]
+        self.cls = rows[:, 5]
+
+
+class _StubResult:
+    def __init__(self, rows):
+        self.boxes = _StubBoxes(rows)
+
+
+class StubModel:
+    """
+    Stands in for a YOLO model: sleeps `latency_ms` per image and returns
+    boxes computed from the image size, so every downstream stage has work
+    """
+
+    def __init__(self, names, boxes_fn, latency_ms=0.0):
+        self.names = names
+        self.boxes_fn = boxes_fn
+        self.latency = latency_ms / 1000.0
+
+    def __call__(self, source, **kwargs):
+        images = source if isinstance(source, list) else [source]
+        if self.latency:
+            time.sleep(self.latency * len(images))
+        return [_StubResult(self.boxes_fn(image)) for image in images]
+
+
+def _stub_pb_boxes(image):
+    # One rider in the middle of the frame: the person's center (about
+    # cy - h/16) is well inside the motorcycle box at any frame size
+    h, w = image.shape[:2]
+    cx, cy = w // 2, h // 2
+    return [
+        (cx - w // 10, cy - h // 4, cx + w // 10, cy + h // 8, 0.9, 0),
+        (cx - w // 8, cy - h // 8, cx + w // 8, cy + h // 4, 0.85, 1),
+    ]
+
+
+def _stub_helmet_boxes(image):
+    # No-helmet box on the head of the (cropped) rider
+    h, w = image.shape[:2]
+    return [(w // 3, h // 10, 2 * w // 3, h // 4, 0.8, 1)]
+
+
+def install_stub_models(latency_ms=0.0):
+    import model_registry
+
+    model_registry._models["pb"] = StubModel(
+        {0: "person", 1: "motorcycle"}, _stub_pb_boxes, latency_ms
+    )
+    model_registry._models["helmet"] = StubModel(
+        {0: "with helmet", 1: "without helmet"}, _stub_helmet_boxes, latency_ms
+    )
+
+
+def make_synthetic_video(path, frames, width, height, fps=30):
+    """
+    Write a video of moving rectangles over noise, so decode cost is real
+    """
+    writer = cv2.VideoWriter(
+        path, cv2.VideoWriter_fourcc(*"MJPG"), fps, (width, height)
+    )
+    rng = np.random.default_rng(0)
+    background = rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+    for i in range(frames):
+        frame = background.copy()
+        x = (i * 7) % max(1, width - 100)
+        cv2.rectangle(
+            frame, (x, height // 3), (x + 100, height // 3 + 200), (255, 255, 255), -1
+        )
+        writer.write(frame)
+    writer.release()
+
+
+# -------------------------
+# PIPELINE
+# -------------------------
+def _instrument_models(timer):
+    # Time each model call inside cascade.detect_frames by name
+    import cascade
+
+    original = cascade.predict
+
+    def timed_predict(name, source, **kwargs):
+        items = len(source) if isinstance(source, list) else 1
+        stage = "pb_inference" if name == "pb" else "helmet_inference"
+        return timer.time(stage, original, name, source, items=items, **kwargs)
+
+    cascade.predict = timed_predict
+    return lambda: setattr(cascade, "predict", original)
+
+
+def run_pipeline(video_path, timer, batch_size, cascade_enabled, db=False, email=False):
+    from cascade import detect_frames
+    from tracker import ViolationTracker, match_riders
+    from video_detect import draw_detections
+
+    tracker = ViolationTracker()
+    cap = cv2.VideoCapture(video_path)
+    frames_done = 0
+    violations = 0
+    restore = _instrument_models(timer)
+    try:
+        while True:
+            frames = []
+            for _ in range(batch_size):
+                start = time.perf_counter()
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                timer.record("decode", time.perf_counter() - start)
+                frames.append(frame)
+            if not frames:
+                break
+
+            detections = detect_frames(frames, cascade=cascade_enabled)
+            for frame, (persons, bikes, no_helmets) in zip(frames, detections):
+                riders, found = timer.time(
+                    "association", match_riders, persons, bikes, no_helmets
+                )
+                timer.time(
+                    "drawing", draw_detections, frame, persons, bikes, no_helmets
+                )
+                events = timer.time(
+                    "tracking", tracker.update, riders, found, frame, frames_done
+                )
+                # Every frame is encoded, as the live view and sink would do
+                ok, encoded = timer.time("image_encode", cv2.imencode, ".jpg", frame)
+                for _ in events:
+                    violations += 1
+                    if db:
+                        timer.time("sink_db", _bench_db_insert)
+                    if email:
+                        timer.time("sink_email", _bench_email)
+                frames_done += 1
+            if len(frames) < batch_size:
+                break
+        # Violations still held by their tracks at the end of the video
+        for _ in tracker.flush():
+            violations += 1
+            if db:
+                timer.time("sink_db", _bench_db_insert)
+            if email:
+                timer.time("sink_email", _bench_email)
+    finally:
+        restore()
+        cap.release()
+    return frames_done, violations
+
+
+class _CountingSink:
+    # Stands in for ViolationSink in --end-to-end runs (no DB or email)
+    def __init__(self):
+        self.events = 0
+
+    def submit(self, event, block=True, timeout=None):
+        self.events += 1
+        return True
+
+    def close(self):
+        pass
+
+
+def run_detect_video(video_path, timer, batch_size, cascade_enabled):
+    from video_detect import detect_video
+
+    sink = _CountingSink()
+    restore = _instrument_models(timer)
+    try:
+        stats = detect_video(
+            video_path, batch_size=batch_size, cascade=cascade_enabled, sink=sink
+        )
+    finally:
+        restore()
+    return stats["frames_total"], sink.events
+
+
+def _bench_db_insert():
+    # Real insert, rolled back so benchmarks leave no rows behind
+    from db_connection import db_connection
+    from violation_sink import INSERT_SQL
+
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                INSERT_SQL,
+                ("bench.jpg", "bench.jpg", "bench.jpg", 500, datetime.now(), "bench"),
+            )
+        finally:
+            conn.rollback()
+            cursor.close()
+
+
+def _bench_email():
+    from notification_email import ADMIN_EMAIL, send_violation_email
+
+    send_violation_email(
+        ADMIN_EMAIL,
+        {"timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "fine_amount": 500},
+    )
+
+
+def _git_commit():
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "--short", "HEAD"],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                stderr=subprocess.DEVNULL,
+            )
+            .decode()
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(
+    video=None,
+    frames=300,
+    width=1280,
+    height=720,
+    batch_size=8,
+    cascade_enabled=True,
+    stub_models=False,
+    stub_latency_ms=0.0,
+    db=False,
+    email=False,
+    end_to_end=False,
+):
+    """
+    Returns:
+        dict: Config, environment, per-stage report and end-to-end throughput
+    """
+    from model_registry import MODEL_BACKEND, MODEL_INT8
+
+    if stub_models:
+        install_stub_models(stub_latency_ms)
+    else:
+        from model_registry import load_all
+
+        load_all()
+
+    tmp_dir = None
+    if video is None:
+        tmp_dir = tempfile.TemporaryDirectory()
+        video = os.path.join(tmp_dir.name, "synthetic.avi")
+        make_synthetic_video(video, frames, width, height)
+
+    timer = StageTimer()
+    start = time.perf_counter()
+    try:
+        if end_to_end:
+            frames_done, violations = run_detect_video(
+                video, timer, max(1, batch_size), cascade_enabled
+            )
+        else:
+            frames_done, violations = run_pipeline(
+                video, timer, max(1, batch_size), cascade_enabled, db, email
+            )
+    finally:
+        if tmp_dir is not None:
+            tmp_dir.cleanup()
+    wall = time.perf_counter() - start
+
+    return {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "config": {
+            "video": video if tmp_dir is None else f"synthetic {width}x{height}",
+            "batch_size": batch_size,
+            "cascade": cascade_enabled,
+            "mode": "detect_video" if end_to_end else "per_stage",
+            "stub_models": stub_models,
+            "stub_latency_ms": stub_latency_ms if stub_models else None,
+            "backend": None if stub_models else MODEL_BACKEND,
+            "int8": None if stub_models else MODEL_INT8,
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "opencv": cv2.__version__,
+            "git_commit": _git_commit(),
+        },
+        "frames": frames_done,
+        "violations": violations,
+        "wall_seconds": round(wall, 3),
+        "fps": round(frames_done / wall, 2) if wall else None,
+        "stages": timer.report(),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Helmettrack pipeline benchmark")
+    parser.add_argument("--video", help="Recorded video (default: synthetic)")
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--no-cascade", action="store_true")
+    parser.add_argument("--stub-models", action="store_true")
+    parser.add_argument("--stub-latency-ms", type=float, default=0.0)
+    parser.add_argument(
+        "--db", action="store_true", help="Time (rolled back) DB inserts"
+    )
+    parser.add_argument("--email", action="store_true", help="Time real alert emails")
+    parser.add_argument(
+        "--end-to-end",
+        action="store_true",
+        help="Run video_detect.detect_video instead of the per-stage loop",
+    )
+    parser.add_argument("--output", help="Write the JSON report here")
+    args = parser.parse_args()
+
+    result = run_benchmark(
+        video=args.video,
+        frames=args.frames,
+        width=args.width,
+        height=args.height,
+        batch_size=args.batch_size,
+        cascade_enabled=not args.no_cascade,
+        stub_models=args.stub_models,
+        stub_latency_ms=args.stub_latency_ms,
+        db=args.db,
+        email=args.email,
+        end_to_end=args.end_to_end,
+    )
+
+    print(
+        f"{result['frames']} frames in {result['wall_seconds']}s ({result['fps']} FPS)"
+    )
+    for stage, s in result["stages"].items():
+        print(
+            f"{stage:17} p50={s['p50_ms']:8.3f}ms p90={s['p90_ms']:8.3f}ms "
+            f"p99={s['p99_ms']:8.3f}ms  {s['throughput_per_s']}/s"
+        )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+        print("Saved:", args.output)
@@ -0,0 +1,112 @@
+"""
+Cascade Detection
+Runs the person/bike detector first and only runs the helmet model on
+crops around riders (persons sitting on a bike). Frames without any rider
+never reach the helmet model.
+"""
+
+from model_registry import get_pb_model, get_helmet_model, predict
+from association import (
+    PERSON,
+    BIKE,
+    NO_HELMET,
+    Boxes,
+    centers,
+    concat_boxes,
+    decode,
+    empty_boxes,
+    points_in_boxes,
+    rider_mask,
+)
+from metrics import STAGE_SECONDS
+import os
+
+# Run the helmet model on rider crops instead of full frames. Off by default:
+# turn it on once it matches full-frame detection on your own footage.
+CASCADE_ENABLED = os.environ.get("CASCADE_ENABLED", "False").lower() == "true"
+# Extra context kept around each rider box (fraction of box size)
+CASCADE_MARGIN = float(os.environ.get("CASCADE_MARGIN", "0.15"))
+# Inference size used for the (small) rider crops
+CASCADE_IMGSZ = int(os.environ.get("CASCADE_IMGSZ", "320"))
+
+
+def _crop_region(xy, shape, margin):
+    x1, y1, x2, y2 = (int(v) for v in xy)
+    h, w = shape[:2]
+    mx = int((x2 - x1) * margin)
+    my = int((y2 - y1) * margin)
+    return (
+        max(0, x1 - mx),
+        max(0, y1 - my),
+        min(w, x2 + mx),
+        min(h, y2 + my),
+    )
+
+
+def detect_frames(
+    frames, cascade=CASCADE_ENABLED, pb_results=None, imgsz=None, helmet=True
+):
+    """
+    Run person/bike and helmet detection on a list of frames
+
+    Args:
+        frames (list): BGR images
+        cascade (bool): Only run the helmet model on rider crops
+        pb_results (list): Person/bike results if already computed
+        imgsz (int): Inference size for full-frame passes (model default
+            when None)
+        helmet (bool): Run the helmet pass (no no-helmet boxes when off)
+
+    Returns:
+        list: (persons, bikes, no_helmets) Boxes for each frame, in input order
+    """
+    pb_names = get_pb_model().names
+    helmet_names = get_helmet_model().names
+    size = {"imgsz": imgsz} if imgsz else {}
+
+    if pb_results is None:
+        with STAGE_SECONDS.time("pb_inference"):
+            pb_results = predict("pb", frames, **size)
+    decoded = [decode(pb_result, pb_names) for pb_result in pb_results]
+
+    if not helmet:
+        return [(d[PERSON], d[BIKE], empty_boxes()) for d in decoded]
+
+    if not cascade:
+        with STAGE_SECONDS.time("helmet_inference"):
+            helmet_results = predict("helmet", frames, **size)
+        return [
+            (d[PERSON], d[BIKE], decode(helmet_result, helmet_names)[NO_HELMET])
+            for d, helmet_result in zip(decoded, helmet_results)
+        ]
+
+    # Collect rider crops from every frame into one helmet batch
+    crops = []
+    owners = []
+    for index, (frame, d) in enumerate(zip(frames, decoded)):
+        persons = d[PERSON]
+        for xyxy in persons.xyxy[rider_mask(persons, d[BIKE])]:
+            x1, y1, x2, y2 = _crop_region(xyxy, frame.shape, CASCADE_MARGIN)
+            if x2 <= x1 or y2 <= y1:
+                continue
+            crops.append(frame[y1:y2, x1:x2])
+            owners.append((index, xyxy, (x1, y1)))
+
+    no_helmets = [[] for _ in frames]
+
+    # Early exit: no person on a bike anywhere in the batch skips the
+    # helmet model entirely
+    if crops:
+        with STAGE_SECONDS.time("helmet_inference"):
+            helmet_results = predict("helmet", crops, imgsz=CASCADE_IMGSZ)
+        for (index, rider, offset), helmet_result in zip(owners, helmet_results):
+            boxes = decode(helmet_result, helmet_names, offset)[NO_HELMET]
+            # Crops of neighbouring riders overlap; keep each box only for
+            # the rider it belongs to
+            own = points_in_boxes(centers(boxes.xyxy), rider[None, :])[:, 0]
+            no_helmets[index].append(Boxes(boxes.xyxy[own], boxes.conf[own]))
+
+    return [
+        (d[PERSON], d[BIKE], concat_boxes(parts))
+        for d, parts in zip(decoded, no_helmets)
+    ]
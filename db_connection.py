@@ -1,14 +1,109 @@
 import mysql.connector
+from mysql.connector import pooling
+from contextlib import contextmanager
+from metrics import DB_ERRORS, DB_SECONDS
+import threading
+import time
+import os
+
+DB_CONFIG = {
+    "host": os.environ.get("DB_HOST", "localhost"),
+    "user": os.environ.get("DB_USER", "root"),
+    "password": os.environ.get("DB_PASSWORD", "Gruthvik1234@"),
+    "database": os.environ.get("DB_NAME", "helmettrack"),
+}
+
+# Connections kept open in the pool
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "5"))
+# Seconds to wait for a free connection when the pool is exhausted
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "10"))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = pooling.MySQLConnectionPool(
+                    pool_name="helmettrack", pool_size=DB_POOL_SIZE, **DB_CONFIG
+                )
+    return _pool
+
+
+def _checkout():
+    """
+    Take a healthy connection from the pool, waiting while it is exhausted.
+    Closing the returned connection hands it back to the pool.
+    """
+    deadline = time.monotonic() + DB_POOL_TIMEOUT
+    while True:
+        try:
+            conn = _get_pool().get_connection()
+            break
+        except mysql.connector.errors.PoolError:
+            if time.monotonic() >= deadline:
+                raise
+            time.sleep(0.05)
+
+    # Health check: reconnect if the server dropped the idle connection
+    try:
+        conn.ping(reconnect=True, attempts=2, delay=0)
+    except mysql.connector.Error:
+        try:
+            conn.close()
+        except mysql.connector.Error:
+            pass
+        raise
+    return conn
+
 
 def get_connection():
     try:
-        conn = mysql.connector.connect(
-            host="localhost",
-            user="root",
-            password="Gruthvik1234@",
-            database="helmettrack"
-        )
-        return conn
+        return _checkout()
     except mysql.connector.Error as err:
+        DB_ERRORS.inc()
         print("Database Error:", err)
         return None
+
+
+@contextmanager
+def db_connection():
+    """
+    with db_connection() as conn: ...
+    The connection always goes back to the pool, even on errors.
+    """
+    conn = _checkout()
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+@contextmanager
+def db_cursor(dictionary=False, commit=False):
+    """
+    with db_cursor(commit=True) as cursor: cursor.execute(...)
+    Commits on success when commit=True, rolls back on errors and always
+    returns the connection to the pool.
+    """
+    start = time.perf_counter()
+    try:
+        with db_connection() as conn:
+            cursor = conn.cursor(dictionary=dictionary)
+            try:
+                yield cursor
+                if commit:
+                    conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                cursor.close()
+    except mysql.connector.Error:
+        DB_ERRORS.inc()
+        raise
+    finally:
+        DB_SECONDS.observe(value=time.perf_counter() - start)
@@ -0,0 +1,350 @@
+"""
+Model Export
+Converts the PyTorch weights in MODEL_PATHS to ONNX or OpenVINO IR for
+faster CPU inference, optionally quantized to INT8 on a folder of our own
+frames, and checks the exported models against PyTorch before they are
+switched on with MODEL_BACKEND / MODEL_INT8.
+
+Models are exported with dynamic input shapes, so batched calls, rider
+crops (CASCADE_IMGSZ) and per-source imgsz keep working.
+
+Usage:
+    python export_models.py export --format onnx
+    python export_models.py export --format openvino --int8 --calibration frames/
+    python export_models.py parity --backend openvino --int8 --images frames/
+
+Optional dependencies: onnx + onnxruntime (ONNX), openvino (OpenVINO IR),
+nncf (OpenVINO INT8).
+"""
+
+from model_registry import MODEL_PATHS, BACKENDS, model_path
+from association import _to_numpy
+import argparse
+import shutil
+import json
+import time
+import cv2
+import numpy as np
+import os
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+# Default export / calibration input size
+EXPORT_IMGSZ = 640
+# Frames used for INT8 calibration
+CALIBRATION_IMAGES = 300
+# Share of PyTorch boxes the exported model must reproduce (same class,
+# IoU >= PARITY_IOU), and share of its boxes that must match PyTorch ones
+PARITY_MIN_MATCH = 0.95
+PARITY_IOU = 0.5
+
+
+def list_images(folder, limit=None):
+    paths = sorted(
+        os.path.join(folder, f)
+        for f in os.listdir(folder)
+        if f.lower().endswith(IMAGE_EXTENSIONS)
+    )
+    return paths[:limit] if limit else paths
+
+
+def preprocess(image, imgsz=EXPORT_IMGSZ):
+    """
+    Letterbox a BGR image the way the ultralytics predictor does
+
+    Returns:
+        numpy.ndarray: 1x3xHxW float32 RGB tensor in [0, 1]
+    """
+    h, w = image.shape[:2]
+    scale = min(imgsz / h, imgsz / w)
+    nh, nw = int(round(h * scale)), int(round(w * scale))
+    canvas = np.full((imgsz, imgsz, 3), 114, dtype=np.uint8)
+    top, left = (imgsz - nh) // 2, (imgsz - nw) // 2
+    canvas[top : top + nh, left : left + nw] = cv2.resize(
+        image, (nw, nh), interpolation=cv2.INTER_LINEAR
+    )
+    tensor = canvas[:, :, ::-1].transpose(2, 0, 1).astype(np.float32) / 255.0
+    return np.ascontiguousarray(tensor[None])
+
+
+def _calibration_tensors(images, imgsz):
+    for path in images:
+        image = cv2.imread(path)
+        if image is not None:
+            yield preprocess(image, imgsz)
+
+
+# -------------------------
+# EXPORT
+# -------------------------
+def quantize_onnx(source, target, images, imgsz=EXPORT_IMGSZ):
+    try:
+        import onnx
+        from onnxruntime.quantization import (
+            CalibrationDataReader,
+            QuantFormat,
+            QuantType,
+            quantize_static,
+        )
+    except ImportError:
+        raise RuntimeError("ONNX INT8 needs: pip install onnx onnxruntime")
+
+    input_name = onnx.load(source).graph.input[0].name
+
+    class Reader(CalibrationDataReader):
+        def __init__(self):
+            self.tensors = _calibration_tensors(images, imgsz)
+
+        def get_next(self):
+            tensor = next(self.tensors, None)
+            return None if tensor is None else {input_name: tensor}
+
+    quantize_static(
+        source,
+        target,
+        Reader(),
+        quant_format=QuantFormat.QDQ,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        per_channel=True,
+    )
+
+    # Keep the class names / stride metadata ultralytics reads on load
+    quantized = onnx.load(target)
+    del quantized.metadata_props[:]
+    quantized.metadata_props.extend(onnx.load(source).metadata_props)
+    onnx.save(quantized, target)
+
+
+def quantize_openvino(source_dir, target_dir, images, imgsz=EXPORT_IMGSZ):
+    try:
+        import nncf
+        from openvino.runtime import Core, serialize
+    except ImportError:
+        raise RuntimeError("OpenVINO INT8 needs: pip install openvino nncf")
+
+    xml = next(f for f in os.listdir(source_dir) if f.endswith(".xml"))
+    model = Core().read_model(os.path.join(source_dir, xml))
+    tensors = list(_calibration_tensors(images, imgsz))
+    quantized = nncf.quantize(
+        model,
+        nncf.Dataset(tensors),
+        preset=nncf.QuantizationPreset.MIXED,
+        subset_size=len(tensors),
+    )
+
+    os.makedirs(target_dir, exist_ok=True)
+    serialize(quantized, os.path.join(target_dir, xml))
+    metadata = os.path.join(source_dir, "metadata.yaml")
+    if os.path.exists(metadata):
+        shutil.copy(metadata, target_dir)
+
+
+def export_model(name, fmt, imgsz=EXPORT_IMGSZ, int8=False, calibration=None):
+    """
+    Export one model (and its INT8 variant when asked)
+
+    Args:
+        name (str): Model name in MODEL_PATHS
+        fmt (str): "onnx" or "openvino"
+        calibration (str): Folder of representative frames (INT8 only)
+
+    Returns:
+        str: Path of the artifact MODEL_BACKEND=fmt will load
+    """
+    from ultralytics import YOLO
+
+    target = model_path(name, fmt, int8=False)
+    exported = YOLO(model_path(name, "pytorch")).export(
+        format=fmt, imgsz=imgsz, dynamic=True
+    )
+    # Hub weights (yolov8n.pt) may be exported next to their download
+    exported = str(exported).rstrip(os.sep)
+    if os.path.abspath(exported) != os.path.abspath(target):
+        if os.path.isdir(target):
+            shutil.rmtree(target)
+        shutil.move(exported, target)
+    if not int8:
+        return target
+
+    images = list_images(calibration, CALIBRATION_IMAGES) if calibration else []
+    if not images:
+        raise RuntimeError("INT8 export needs --calibration with some frames")
+    quantized = model_path(name, fmt, int8=True)
+    if fmt == "onnx":
+        quantize_onnx(target, quantized, images, imgsz)
+    else:
+        quantize_openvino(target, quantized, images, imgsz)
+    return quantized
+
+
+# -------------------------
+# PARITY CHECK
+# -------------------------
+def _iou(box, boxes):
+    x1 = np.maximum(box[0], boxes[:, 0])
+    y1 = np.maximum(box[1], boxes[:, 1])
+    x2 = np.minimum(box[2], boxes[:, 2])
+    y2 = np.minimum(box[3], boxes[:, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    return inter / np.maximum(area + areas - inter, 1e-9)
+
+
+def match_detections(reference, candidate, iou_threshold=PARITY_IOU):
+    """
+    Greedily pair boxes of the same class, most confident reference first
+
+    Args:
+        reference, candidate: (xyxy, cls, conf) arrays
+
+    Returns:
+        list: (IoU, confidence difference) per matched pair
+    """
+    ref_xyxy, ref_cls, ref_conf = reference
+    cand_xyxy, cand_cls, cand_conf = candidate
+    used = np.zeros(len(cand_xyxy), dtype=bool)
+    pairs = []
+    for i in np.argsort(-ref_conf):
+        free = np.flatnonzero(~used & (cand_cls == ref_cls[i]))
+        if not len(free):
+            continue
+        ious = _iou(ref_xyxy[i], cand_xyxy[free])
+        best = int(np.argmax(ious))
+        if ious[best] >= iou_threshold:
+            used[free[best]] = True
+            pairs.append(
+                (float(ious[best]), abs(float(ref_conf[i] - cand_conf[free[best]])))
+            )
+    return pairs
+
+
+def _detections(model, image, imgsz):
+    boxes = model(image, imgsz=imgsz, verbose=False)[0].boxes
+    return (
+        _to_numpy(boxes.xyxy).reshape(-1, 4).astype(np.float32),
+        _to_numpy(boxes.cls).reshape(-1).astype(np.int32),
+        _to_numpy(boxes.conf).reshape(-1).astype(np.float32),
+    )
+
+
+def parity_check(
+    backend,
+    images,
+    int8=False,
+    imgsz=EXPORT_IMGSZ,
+    names=None,
+    min_match=PARITY_MIN_MATCH,
+):
+    """
+    Run PyTorch and the exported models on the same frames
+
+    Returns:
+        dict: Per model: boxes on each side, match rates, mean IoU, worst
+            confidence difference, ms per image and whether it passed
+    """
+    from ultralytics import YOLO
+
+    report = {}
+    for name in names or MODEL_PATHS:
+        reference_model = YOLO(model_path(name, "pytorch"))
+        exported_model = YOLO(model_path(name, backend, int8), task="detect")
+        stats = {"reference_boxes": 0, "exported_boxes": 0, "pairs": []}
+        seconds = {"pytorch": 0.0, backend: 0.0}
+
+        for path in images:
+            image = cv2.imread(path)
+            if image is None:
+                continue
+            start = time.perf_counter()
+            reference = _detections(reference_model, image, imgsz)
+            seconds["pytorch"] += time.perf_counter() - start
+            start = time.perf_counter()
+            exported = _detections(exported_model, image, imgsz)
+            seconds[backend] += time.perf_counter() - start
+
+            stats["reference_boxes"] += len(reference[0])
+            stats["exported_boxes"] += len(exported[0])
+            stats["pairs"] += match_detections(reference, exported)
+
+        pairs = stats.pop("pairs")
+        matched = len(pairs)
+        recall = matched / stats["reference_boxes"] if stats["reference_boxes"] else 1.0
+        precision = (
+            matched / stats["exported_boxes"] if stats["exported_boxes"] else 1.0
+        )
+        stats.update(
+            {
+                "matched": matched,
+                "recall": round(recall, 4),
+                "precision": round(precision, 4),
+                "mean_iou": (
+                    round(float(np.mean([p[0] for p in pairs])), 4) if pairs else None
+                ),
+                "max_conf_diff": round(max(p[1] for p in pairs), 4) if pairs else None,
+                "ms_per_image": {
+                    k: round(v * 1000.0 / max(1, len(images)), 2)
+                    for k, v in seconds.items()
+                },
+                "passed": min(recall, precision) >= min_match,
+            }
+        )
+        report[name] = stats
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Helmettrack model export")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    export = sub.add_parser("export", help="Export ONNX / OpenVINO artifacts")
+    export.add_argument("--format", choices=BACKENDS[1:], default="onnx")
+    export.add_argument("--int8", action="store_true")
+    export.add_argument("--calibration", help="Folder of frames for INT8")
+    export.add_argument("--imgsz", type=int, default=EXPORT_IMGSZ)
+    export.add_argument("--models", nargs="+", choices=list(MODEL_PATHS))
+
+    parity = sub.add_parser("parity", help="Compare exported models with PyTorch")
+    parity.add_argument("--backend", choices=BACKENDS[1:], default="onnx")
+    parity.add_argument("--int8", action="store_true")
+    parity.add_argument("--images", required=True, help="Folder of test frames")
+    parity.add_argument("--limit", type=int, default=100)
+    parity.add_argument("--imgsz", type=int, default=EXPORT_IMGSZ)
+    parity.add_argument("--models", nargs="+", choices=list(MODEL_PATHS))
+    parity.add_argument("--min-match", type=float, default=PARITY_MIN_MATCH)
+    parity.add_argument("--output", help="Write the JSON report here")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        for name in args.models or MODEL_PATHS:
+            try:
+                print(
+                    "Exported:",
+                    export_model(
+                        name, args.format, args.imgsz, args.int8, args.calibration
+                    ),
+                )
+            except Exception as e:
+                print(f"Export error ({name}):", e)
+                raise SystemExit(1)
+    else:
+        report = parity_check(
+            args.backend,
+            list_images(args.images, args.limit),
+            args.int8,
+            args.imgsz,
+            args.models,
+            args.min_match,
+        )
+        for name, stats in report.items():
+            print(
+                f"{name:7} recall={stats['recall']} precision={stats['precision']} "
+                f"mean_iou={stats['mean_iou']} ms/image={stats['ms_per_image']} "
+                + ("OK" if stats["passed"] else "FAILED")
+            )
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(report, f, indent=2)
+        if not all(stats["passed"] for stats in report.values()):
+            raise SystemExit(1)
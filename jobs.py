@@ -0,0 +1,357 @@
+"""
+Video Detection Jobs
+Durable job queue in MySQL (video_jobs, see migrations/) so long videos are
+processed by worker processes instead of inside the upload request. Any
+number of workers can drain the queue: claims use SELECT ... FOR UPDATE
+SKIP LOCKED so each job runs once.
+
+Jobs store the path the web app saved the upload to. Workers on other
+hosts must see that path too (UPLOAD_FOLDER on shared storage mounted at
+the same location); a job whose video cannot be read is marked failed.
+
+Usage:
+    python jobs.py worker --processes 4
+"""
+
+from db_connection import db_cursor
+from metrics import Gauge, start_snapshot_writer
+import multiprocessing
+import threading
+import argparse
+import socket
+import time
+import os
+
+# Seconds an idle worker sleeps before polling the queue again
+JOB_POLL_SECONDS = float(os.environ.get("JOB_POLL_SECONDS", "2.0"))
+# Min seconds between progress writes to the database
+JOB_PROGRESS_SECONDS = float(os.environ.get("JOB_PROGRESS_SECONDS", "1.0"))
+# Running jobs with no heartbeat for this long are requeued (worker died)
+JOB_STALE_SECONDS = int(os.environ.get("JOB_STALE_SECONDS", "120"))
+# Heartbeats while a job runs, progress or not (warm-up, sink drain at the end)
+JOB_HEARTBEAT_SECONDS = JOB_STALE_SECONDS / 4.0
+# Claims per job before a job whose worker keeps dying is marked failed
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "3"))
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+def _job_counts():
+    with db_cursor() as cursor:
+        cursor.execute(
+            "SELECT status, COUNT(*) FROM video_jobs "
+            "WHERE status IN (%s, %s) GROUP BY status",
+            (QUEUED, RUNNING),
+        )
+        counts = {(QUEUED,): 0, (RUNNING,): 0}
+        counts.update({(status,): count for status, count in cursor.fetchall()})
+        return counts
+
+
+JOB_QUEUE_DEPTH = Gauge(
+    "helmettrack_job_queue_depth",
+    "Video jobs waiting or running",
+    ("status",),
+    callback=_job_counts,
+)
+
+
+def enqueue_job(video_path):
+    """
+    Args:
+        video_path (str): Uploaded video to process
+
+    Returns:
+        int: ID of the new job
+    """
+    with db_cursor(commit=True) as cursor:
+        cursor.execute(
+            "INSERT INTO video_jobs (video_path, status) VALUES (%s, %s)",
+            (video_path, QUEUED),
+        )
+        return cursor.lastrowid
+
+
+def claim_job(worker):
+    """
+    Atomically take the oldest queued job
+
+    Args:
+        worker (str): Worker name recorded on the job
+
+    Returns:
+        dict: The claimed job (id, video_path, attempts), or None when the
+            queue is empty
+    """
+    with db_cursor(dictionary=True, commit=True) as cursor:
+        # SKIP LOCKED lets concurrent workers pass over rows another
+        # worker is claiming instead of waiting on them
+        cursor.execute(
+            "SELECT id, video_path, attempts FROM video_jobs WHERE status=%s "
+            "ORDER BY id LIMIT 1 FOR UPDATE SKIP LOCKED",
+            (QUEUED,),
+        )
+        job = cursor.fetchone()
+        if job is None:
+            return None
+        # Timestamps come from the database clock, the one
+        # requeue_stale_jobs compares them with
+        cursor.execute(
+            "UPDATE video_jobs SET status=%s, worker=%s, started_at=NOW(), "
+            "heartbeat_at=NOW(), attempts=attempts + 1, error=NULL WHERE id=%s",
+            (RUNNING, worker, job["id"]),
+        )
+        # Identifies this claim; a requeued job gets a new one
+        job["attempts"] += 1
+        return job
+
+
+def _claim_filter(job_id, attempt):
+    if attempt is None:
+        return "id=%s", (job_id,)
+    return "id=%s AND attempts=%s", (job_id, attempt)
+
+
+def update_progress(job_id, stats, fps, attempt=None):
+    """
+    Record progress and refresh the heartbeat (only the heartbeat when
+    stats is None)
+
+    Args:
+        attempt (int): Claim the update belongs to; a job requeued and
+            claimed again since is left alone
+    """
+    where, params = _claim_filter(job_id, attempt)
+    with db_cursor(commit=True) as cursor:
+        if stats is None:
+            cursor.execute(
+                f"UPDATE video_jobs SET heartbeat_at=NOW() WHERE {where}", params
+            )
+            return
+        cursor.execute(
+            "UPDATE video_jobs SET frames_expected=%s, frames_processed=%s, "
+            f"fps=%s, violations=%s, heartbeat_at=NOW() WHERE {where}",
+            (
+                stats["frames_expected"],
+                stats["frames_total"],
+                fps,
+                stats["violations"],
+            )
+            + params,
+        )
+
+
+def finish_job(job_id, status, error=None, attempt=None):
+    """
+    Returns:
+        bool: False when the job was claimed again since `attempt` (nothing
+            is updated then)
+    """
+    where, params = _claim_filter(job_id, attempt)
+    with db_cursor(commit=True) as cursor:
+        cursor.execute(
+            f"UPDATE video_jobs SET status=%s, error=%s, finished_at=NOW() WHERE {where}",
+            (status, error) + params,
+        )
+        return cursor.rowcount > 0
+
+
+def requeue_stale_jobs(stale_seconds=JOB_STALE_SECONDS):
+    """
+    Put running jobs whose worker stopped sending heartbeats back in the
+    queue; jobs already claimed JOB_MAX_ATTEMPTS times are marked failed
+
+    Returns:
+        int: Number of jobs requeued
+    """
+    with db_cursor(commit=True) as cursor:
+        cursor.execute(
+            "UPDATE video_jobs SET status=%s, worker=NULL, finished_at=NOW(), "
+            "error=%s WHERE status=%s AND attempts >= %s "
+            "AND heartbeat_at < NOW() - INTERVAL %s SECOND",
+            (
+                FAILED,
+                f"Worker stopped responding {JOB_MAX_ATTEMPTS} times",
+                RUNNING,
+                JOB_MAX_ATTEMPTS,
+                int(stale_seconds),
+            ),
+        )
+        if cursor.rowcount:
+            print("Video jobs failed after repeated worker crashes:", cursor.rowcount)
+        cursor.execute(
+            "UPDATE video_jobs SET status=%s, worker=NULL WHERE status=%s "
+            "AND heartbeat_at < NOW() - INTERVAL %s SECOND",
+            (QUEUED, RUNNING, int(stale_seconds)),
+        )
+        return cursor.rowcount
+
+
+def get_job_status(job_id):
+    """
+    Returns:
+        dict: Job progress (frames, FPS, ETA in seconds, violations so far),
+            or None if the job does not exist
+    """
+    with db_cursor(dictionary=True) as cursor:
+        cursor.execute(
+            "SELECT id, status, worker, frames_expected, frames_processed, fps, "
+            "violations, error, created_at, started_at, finished_at "
+            "FROM video_jobs WHERE id=%s",
+            (job_id,),
+        )
+        job = cursor.fetchone()
+    if job is None:
+        return None
+
+    eta = None
+    if job["status"] == RUNNING and job["fps"] > 0 and job["frames_expected"]:
+        remaining = max(0, job["frames_expected"] - job["frames_processed"])
+        eta = round(remaining / job["fps"], 1)
+    elif job["status"] == DONE:
+        eta = 0
+    job["eta_seconds"] = eta
+    for key in ("created_at", "started_at", "finished_at"):
+        if job[key] is not None:
+            job[key] = job[key].strftime("%Y-%m-%d %H:%M:%S")
+    return job
+
+
+# -------------------------
+# WORKERS
+# -------------------------
+class _JobReporter:
+    """
+    detect_video progress callback (throttled to JOB_PROGRESS_SECONDS) plus
+    a heartbeat thread, so a job stays claimed while no batch completes:
+    model warm-up, a stalled batch, or sink.close() draining inserts and
+    emails after the last frame
+    """
+
+    def __init__(self, job_id, attempt):
+        self.job_id = job_id
+        self.attempt = attempt
+        self.started = time.monotonic()
+        self._last = 0.0
+        self._latest = (None, None)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._beat, name=f"job-{job_id}-heartbeat", daemon=True
+        )
+
+    def _update(self, stats, fps):
+        try:
+            update_progress(self.job_id, stats, fps, self.attempt)
+        except Exception as e:
+            print("Job progress error:", e)
+
+    def __call__(self, stats):
+        now = time.monotonic()
+        fps = round(stats["frames_total"] / max(now - self.started, 1e-6), 2)
+        self._latest = (dict(stats), fps)
+        if now - self._last < JOB_PROGRESS_SECONDS:
+            return
+        self._last = now
+        self._update(stats, fps)
+
+    def _beat(self):
+        while not self._stop.wait(JOB_HEARTBEAT_SECONDS):
+            self._update(*self._latest)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+def run_job(job):
+    from video_detect import detect_video
+
+    job_id = job["id"]
+    attempt = job.get("attempts")
+    reporter = _JobReporter(job_id, attempt)
+    reporter.start()
+    try:
+        stats = detect_video(job["video_path"], progress=reporter)
+    except Exception as e:
+        print(f"Job {job_id} failed:", e)
+        finish_job(job_id, FAILED, str(e), attempt)
+        return
+    finally:
+        reporter.stop()
+    fps = stats["frames_total"] / max(time.monotonic() - reporter.started, 1e-6)
+    update_progress(job_id, stats, round(fps, 2), attempt)
+    if not finish_job(job_id, DONE, attempt=attempt):
+        print(f"Job {job_id} was claimed by another worker; result not recorded")
+
+
+def worker_loop(name=None, poll_seconds=JOB_POLL_SECONDS, stop=None):
+    """
+    Claim and run jobs until `stop` (a multiprocessing.Event) is set
+
+    Args:
+        name (str): Worker name, defaults to host:pid
+        poll_seconds (float): Sleep between polls while the queue is empty
+    """
+    from model_registry import load_all
+
+    name = name or f"{socket.gethostname()}:{os.getpid()}"
+    # Job metrics (frames, stages, sink DB / SMTP) reach the app's /metrics
+    start_snapshot_writer()
+    load_all()
+    print("Job worker started:", name)
+    while stop is None or not stop.is_set():
+        try:
+            requeue_stale_jobs()
+            job = claim_job(name)
+        except Exception as e:
+            print("Job queue error:", e)
+            job = None
+        if job is None:
+            if stop is not None:
+                stop.wait(poll_seconds)
+            else:
+                time.sleep(poll_seconds)
+            continue
+        print(f"Worker {name} running job {job['id']}: {job['video_path']}")
+        run_job(job)
+
+
+def start_worker_pool(processes):
+    """
+    Start `processes` worker processes
+
+    Returns:
+        tuple: (list of processes, stop event)
+    """
+    ctx = multiprocessing.get_context("spawn")
+    stop = ctx.Event()
+    workers = [
+        ctx.Process(target=worker_loop, kwargs={"stop": stop}, daemon=True)
+        for _ in range(max(1, int(processes)))
+    ]
+    for process in workers:
+        process.start()
+    return workers, stop
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Helmettrack video job workers")
+    sub = parser.add_subparsers(dest="command", required=True)
+    worker = sub.add_parser("worker", help="Process queued video jobs")
+    worker.add_argument("--processes", type=int, default=1)
+    args = parser.parse_args()
+
+    workers, stop = start_worker_pool(args.processes)
+    try:
+        for process in workers:
+            process.join()
+    except KeyboardInterrupt:
+        stop.set()
+        for process in workers:
+            process.join()
@@ -0,0 +1,172 @@
+"""
+Latency Budget
+Keeps each live stream close to a target capture-to-result latency. When
+inference falls behind, the controller steps down a ladder of cheaper
+settings (analyse fewer frames, smaller inference size, finally no helmet
+pass) and steps back up once the measured cost of the better level fits
+the budget again, so rush-hour load degrades quality instead of piling up
+minutes of delay.
+"""
+
+from metrics import LATENCY_BUDGET_LEVEL, LATENCY_BUDGET_CHANGES
+import threading
+import time
+import os
+
+# Target capture-to-result latency per stream (0 disables the controller)
+LATENCY_TARGET_MS = float(os.environ.get("LATENCY_TARGET_MS", "300"))
+# Minimum time between two steps down / before a step back up
+LATENCY_DOWN_SECONDS = float(os.environ.get("LATENCY_DOWN_SECONDS", "1"))
+LATENCY_UP_SECONDS = float(os.environ.get("LATENCY_UP_SECONDS", "5"))
+# Step up only while latency stays below this share of the target
+LATENCY_RECOVER_RATIO = 0.6
+# Per-level cost measurements older than this are retried, not trusted
+LATENCY_COST_TTL_SECONDS = 30.0
+# Smoothing of the latency / cost averages (weight of the newest sample)
+LATENCY_SMOOTHING = 0.2
+
+# (frame stride, inference size cap, helmet pass), best quality first.
+# None keeps the source / model default size.
+LATENCY_LEVELS = (
+    (1, None, True),
+    (1, 480, True),
+    (2, 480, True),
+    (2, 320, True),
+    (3, 320, True),
+    (4, 320, False),
+)
+
+
+def _smooth(average, value):
+    if average is None:
+        return value
+    return average + LATENCY_SMOOTHING * (value - average)
+
+
+class LatencyController:
+    """
+    Usage (one per stream):
+        if controller.admit():
+            ... detect(frames, settings, imgsz=controller.imgsz,
+                       helmet=controller.helmet) ...
+            controller.observe(latency_seconds, cost_seconds)
+    """
+
+    def __init__(self, name, target_ms=LATENCY_TARGET_MS, levels=LATENCY_LEVELS):
+        self.name = name
+        self.target = target_ms / 1000.0
+        self.levels = levels
+        self.level = 0
+        self.latency = None
+        self.changes = 0
+        self._costs = {}
+        self._count = 0
+        self._changed_at = time.monotonic()
+        self._lock = threading.Lock()
+        LATENCY_BUDGET_LEVEL.set(name, value=0)
+
+    @property
+    def stride(self):
+        return self.levels[self.level][0]
+
+    @property
+    def imgsz(self):
+        return self.levels[self.level][1]
+
+    @property
+    def helmet(self):
+        return self.levels[self.level][2]
+
+    def admit(self):
+        """
+        Returns:
+            bool: Whether this frame should be analysed (frame stride)
+        """
+        with self._lock:
+            self._count += 1
+            return self._count % self.stride == 0
+
+    def observe(self, latency, cost):
+        """
+        Record one analysed frame and adjust the level if needed
+
+        Args:
+            latency (float): Capture to result, in seconds
+            cost (float): Inference and post-processing time the frame
+                needed, in seconds
+        """
+        now = time.monotonic()
+        with self._lock:
+            self.latency = _smooth(self.latency, latency)
+            previous = self._costs.get(self.level)
+            self._costs[self.level] = (
+                _smooth(previous[0] if previous else None, cost),
+                now,
+            )
+            since = now - self._changed_at
+
+            if (
+                self.latency > self.target
+                and self.level < len(self.levels) - 1
+                and since >= LATENCY_DOWN_SECONDS
+            ):
+                self._set_level(self.level + 1, "down", now)
+            elif (
+                self.level > 0
+                and self.latency < self.target * LATENCY_RECOVER_RATIO
+                and since >= LATENCY_UP_SECONDS
+                and self._fits(self.level - 1, now)
+            ):
+                self._set_level(self.level - 1, "up", now)
+
+    def _fits(self, level, now):
+        # Unknown or outdated costs are worth a retry; load may have dropped
+        measured = self._costs.get(level)
+        if measured is None or now - measured[1] > LATENCY_COST_TTL_SECONDS:
+            return True
+        return measured[0] < self.target * LATENCY_RECOVER_RATIO
+
+    def _set_level(self, level, direction, now):
+        self.level = level
+        self.changes += 1
+        self._count = 0
+        self._changed_at = now
+        # Samples taken at the old level say little about the new one
+        self.latency = None
+        LATENCY_BUDGET_LEVEL.set(self.name, value=level)
+        LATENCY_BUDGET_CHANGES.inc(self.name, direction)
+        print(
+            f"Latency budget {self.name}: {direction} to level {level} "
+            f"(stride {self.stride}, imgsz {self.imgsz or 'default'}, "
+            f"helmet {'on' if self.helmet else 'off'})"
+        )
+
+    def status(self):
+        with self._lock:
+            return {
+                "target_ms": round(self.target * 1000.0, 1),
+                "level": self.level,
+                "stride": self.stride,
+                "imgsz": self.imgsz,
+                "helmet": self.helmet,
+                "latency_ms": (
+                    round(self.latency * 1000.0, 1)
+                    if self.latency is not None
+                    else None
+                ),
+                "cost_ms": {
+                    level: round(cost * 1000.0, 1)
+                    for level, (cost, _) in sorted(self._costs.items())
+                },
+                "changes": self.changes,
+            }
+
+
+def make_controller(name, target_ms=LATENCY_TARGET_MS):
+    """
+    Returns:
+        LatencyController: None when the budget is disabled (target 0)
+    """
+    if not target_ms or target_ms <= 0:
+        return None
+    return LatencyController(name, target_ms)
@@ -0,0 +1,394 @@
+"""
+Metrics
+Minimal Prometheus-style counters, gauges and histograms for the detection
+loops and Flask routes, rendered in the text exposition format by /metrics.
+
+Updating a metric is a dict lookup plus an addition under a lock (a few
+microseconds), so per-frame instrumentation stays far below 1% of the
+tens of milliseconds each frame takes.
+
+Worker processes (video jobs, segment workers) call start_snapshot_writer()
+and periodically write their values to METRICS_DIR; render() in the Flask
+process adds them to its own. Counters and histograms are summed across
+processes, gauges too (e.g. total FPS of all workers) unless they are
+computed at scrape time. Workers on other hosts need their own scrape.
+"""
+
+from contextlib import contextmanager
+from multiprocessing import util
+import threading
+import tempfile
+import bisect
+import json
+import time
+import os
+
+# Shared directory for the metric snapshots of worker processes
+METRICS_DIR = os.environ.get(
+    "METRICS_DIR", os.path.join(tempfile.gettempdir(), "helmettrack_metrics")
+)
+# Seconds between snapshot writes in worker processes
+METRICS_SNAPSHOT_SECONDS = float(os.environ.get("METRICS_SNAPSHOT_SECONDS", "5"))
+# Gauges of processes that stopped writing this long ago are ignored
+METRICS_STALE_SECONDS = 60.0
+
+# Seconds; covers sub-millisecond drawing up to multi-second DB/SMTP stalls
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    pairs += [f'{n}="{_escape(v)}"' for n, v in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}")
+        return tuple(str(v) for v in labels)
+
+    @staticmethod
+    def _copy(value):
+        return value
+
+    @staticmethod
+    def _add(value, other):
+        return value + other
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: {label tuple: value} copy of this process's values
+        """
+        with self._lock:
+            return {key: self._copy(value) for key, value in self._values.items()}
+
+    def _collect(self, foreign=()):
+        # Own values plus (label list, value) pairs from other processes
+        values = self.snapshot()
+        for key, value in foreign:
+            key = tuple(key)
+            values[key] = self._add(values[key], value) if key in values else value
+        return values
+
+    def _samples(self, values):
+        return [(self.name, key, (), value) for key, value in values.items()]
+
+    def render(self, foreign=()):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        for name, key, extra, value in self._samples(self._collect(foreign)):
+            labels = _format_labels(self.labelnames, key, extra)
+            lines.append(f"{name}{labels} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """
+    Set directly, or give `callback` (returning {label tuple: value}) to read
+    the value at scrape time, e.g. queue depths
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def set(self, *labels, value):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def snapshot(self):
+        # Scrape-time values are computed where they are scraped, not shared
+        if self.callback is not None:
+            return {}
+        return super().snapshot()
+
+    def _collect(self, foreign=()):
+        if self.callback is None:
+            return super()._collect(foreign)
+        try:
+            values = self.callback()
+        except Exception as e:
+            print("Metrics callback error:", e)
+            return {}
+        return {tuple(str(v) for v in key): value for key, value in values.items()}
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, *labels, value):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, *labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(*labels, value=time.perf_counter() - start)
+
+    @staticmethod
+    def _copy(value):
+        return [list(value[0]), value[1], value[2]]
+
+    @staticmethod
+    def _add(value, other):
+        return [
+            [a + b for a, b in zip(value[0], other[0])],
+            value[1] + other[1],
+            value[2] + other[2],
+        ]
+
+    def _samples(self, values):
+        samples = []
+        for key, (counts, total, count) in values.items():
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                samples.append((f"{self.name}_bucket", key, (("le", le),), cumulative))
+            samples.append((f"{self.name}_sum", key, (), total))
+            samples.append((f"{self.name}_count", key, (), count))
+        return samples
+
+
+def render():
+    """
+    Returns:
+        str: Every registered metric in Prometheus text format, including
+            the snapshots written by worker processes
+    """
+    with _registry_lock:
+        metrics = list(_registry)
+    foreign = _read_snapshots()
+    return (
+        "\n".join(metric.render(foreign.get(metric.name, ())) for metric in metrics)
+        + "\n"
+    )
+
+
+# -------------------------
+# WORKER PROCESS SNAPSHOTS
+# -------------------------
+def _snapshot_path(pid=None):
+    return os.path.join(METRICS_DIR, f"{pid or os.getpid()}.json")
+
+
+def write_snapshot():
+    with _registry_lock:
+        metrics = list(_registry)
+    data = {
+        "written_at": time.time(),
+        "metrics": {
+            metric.name: [[list(k), v] for k, v in metric.snapshot().items()]
+            for metric in metrics
+        },
+    }
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    path = _snapshot_path()
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+
+def _read_snapshots():
+    # {metric name: [(labels, value), ...]} from every other process
+    foreign = {}
+    try:
+        names = os.listdir(METRICS_DIR)
+    except OSError:
+        return foreign
+    with _registry_lock:
+        gauges = {metric.name for metric in _registry if isinstance(metric, Gauge)}
+    own = os.path.basename(_snapshot_path())
+    for name in names:
+        if not name.endswith(".json") or name == own:
+            continue
+        try:
+            with open(os.path.join(METRICS_DIR, name)) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        # Counters of finished workers still count; their gauges do not
+        stale = time.time() - data.get("written_at", 0) > METRICS_STALE_SECONDS
+        for metric_name, values in data.get("metrics", {}).items():
+            if stale and metric_name in gauges:
+                continue
+            foreign.setdefault(metric_name, []).extend(values)
+    return foreign
+
+
+def clear_snapshots():
+    """
+    Remove snapshots left by earlier runs (called once at app startup)
+    """
+    try:
+        names = os.listdir(METRICS_DIR)
+    except OSError:
+        return
+    for name in names:
+        try:
+            os.remove(os.path.join(METRICS_DIR, name))
+        except OSError:
+            pass
+
+
+def start_snapshot_writer(interval=METRICS_SNAPSHOT_SECONDS):
+    """
+    Publish this (worker) process's metrics to METRICS_DIR every `interval`
+    seconds and at exit
+    """
+
+    def _safe_write():
+        try:
+            write_snapshot()
+        except Exception as e:
+            print("Metrics snapshot error:", e)
+
+    def run():
+        while True:
+            time.sleep(interval)
+            _safe_write()
+
+    # Runs at normal exit of the main process and of multiprocessing children
+    util.Finalize(None, _safe_write, exitpriority=10)
+    threading.Thread(target=run, name="metrics-snapshot", daemon=True).start()
+
+
+# -------------------------
+# PIPELINE METRICS
+# -------------------------
+FRAMES = Counter(
+    "helmettrack_frames_total",
+    "Frames handled per source, by outcome (inferred, skipped_stride, "
+    "skipped_motion, dropped, stale)",
+    ("source", "outcome"),
+)
+SOURCE_FPS = Gauge(
+    "helmettrack_source_fps", "Frames inferred per second, per source", ("source",)
+)
+STAGE_SECONDS = Histogram(
+    "helmettrack_stage_seconds",
+    "Time per pipeline stage call (decode, pb_inference, helmet_inference, "
+    "postprocess, image_encode)",
+    ("stage",),
+)
+VIOLATIONS = Counter(
+    "helmettrack_violations_total", "Violations emitted per source", ("source",)
+)
+DB_SECONDS = Histogram("helmettrack_db_seconds", "Time holding a DB cursor")
+DB_ERRORS = Counter("helmettrack_db_errors_total", "Failed DB operations")
+SMTP_SECONDS = Histogram("helmettrack_smtp_seconds", "Time to send one email")
+SMTP_ERRORS = Counter("helmettrack_smtp_errors_total", "Failed email sends")
+STREAM_LATENCY_SECONDS = Histogram(
+    "helmettrack_stream_latency_seconds",
+    "Capture to annotated frame latency, per camera",
+    ("source",),
+)
+LATENCY_BUDGET_LEVEL = Gauge(
+    "helmettrack_latency_budget_level",
+    "Degradation level chosen by the latency budget (0 = full quality)",
+    ("source",),
+)
+LATENCY_BUDGET_CHANGES = Counter(
+    "helmettrack_latency_budget_changes_total",
+    "Latency budget level changes, by direction (down, up)",
+    ("source", "direction"),
+)
+HTTP_REQUESTS = Counter(
+    "helmettrack_http_requests_total", "HTTP requests", ("endpoint", "status")
+)
+HTTP_SECONDS = Histogram(
+    "helmettrack_http_request_seconds", "HTTP request latency", ("endpoint",)
+)
+
+
+class RateMeter:
+    """
+    Publishes a per-source FPS gauge, recomputed at most once a second
+    """
+
+    def __init__(self, source, interval=1.0):
+        self.source = source
+        self.interval = interval
+        self._count = 0
+        self._since = time.monotonic()
+
+    def add(self, frames):
+        self._count += frames
+        now = time.monotonic()
+        elapsed = now - self._since
+        if elapsed >= self.interval:
+            SOURCE_FPS.set(self.source, value=round(self._count / elapsed, 2))
+            self._count = 0
+            self._since = now
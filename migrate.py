@@ -0,0 +1,53 @@
+"""
+Database Migrations
+Applies the SQL files in migrations/ in name order, once each.
+
+Usage:
+    python migrate.py
+"""
+
+from db_connection import db_cursor
+import os
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MIGRATIONS_FOLDER = os.path.join(BASE_DIR, "migrations")
+
+
+def _statements(sql):
+    # Strip comment lines, then split on ";" (migrations contain no procedures)
+    lines = [l for l in sql.splitlines() if not l.strip().startswith("--")]
+    return [s.strip() for s in "\n".join(lines).split(";") if s.strip()]
+
+
+def migrate():
+    """
+    Returns:
+        list: Names of the migrations applied by this run
+    """
+    with db_cursor(commit=True) as cursor:
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "name VARCHAR(255) PRIMARY KEY, "
+            "applied_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP)"
+        )
+        cursor.execute("SELECT name FROM schema_migrations")
+        applied = {row[0] for row in cursor.fetchall()}
+
+    done = []
+    for name in sorted(os.listdir(MIGRATIONS_FOLDER)):
+        if not name.endswith(".sql") or name in applied:
+            continue
+        with open(os.path.join(MIGRATIONS_FOLDER, name), encoding="utf-8") as f:
+            statements = _statements(f.read())
+        with db_cursor(commit=True) as cursor:
+            for statement in statements:
+                cursor.execute(statement)
+            cursor.execute("INSERT INTO schema_migrations (name) VALUES (%s)", (name,))
+        print("Applied migration:", name)
+        done.append(name)
+    return done
+
+
+if __name__ == "__main__":
+    if not migrate():
+        print("Database is up to date")
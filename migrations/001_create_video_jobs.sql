@@ -0,0 +1,17 @@
+-- Background video detection jobs (see jobs.py)
+CREATE TABLE IF NOT EXISTS video_jobs (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    video_path VARCHAR(512) NOT NULL,
+    status ENUM('queued', 'running', 'done', 'failed') NOT NULL DEFAULT 'queued',
+    worker VARCHAR(128) NULL,
+    frames_expected INT NOT NULL DEFAULT 0,
+    frames_processed INT NOT NULL DEFAULT 0,
+    fps FLOAT NOT NULL DEFAULT 0,
+    violations INT NOT NULL DEFAULT 0,
+    error TEXT NULL,
+    created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    started_at DATETIME NULL,
+    heartbeat_at DATETIME NULL,
+    finished_at DATETIME NULL,
+    INDEX idx_video_jobs_status_id (status, id)
+);
@@ -0,0 +1,2 @@
+-- Keyset pagination of the violations listing (see records.py)
+CREATE INDEX idx_no_helmet_records_timestamp_id ON no_helmet_records (timestamp, id);
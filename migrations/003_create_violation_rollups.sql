@@ -0,0 +1,18 @@
+-- Violation counts and fines per hour / day and source (see rollups.py)
+ALTER TABLE no_helmet_records ADD COLUMN source VARCHAR(128) NULL;
+
+CREATE TABLE IF NOT EXISTS violation_rollup_hourly (
+    bucket DATETIME NOT NULL,
+    source VARCHAR(128) NOT NULL,
+    violations INT NOT NULL DEFAULT 0,
+    fine_total BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (bucket, source)
+);
+
+CREATE TABLE IF NOT EXISTS violation_rollup_daily (
+    day DATE NOT NULL,
+    source VARCHAR(128) NOT NULL,
+    violations INT NOT NULL DEFAULT 0,
+    fine_total BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, source)
+);
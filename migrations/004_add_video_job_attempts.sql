@@ -0,0 +1,2 @@
+-- Claims per job, so a job that keeps killing its worker stops being requeued
+ALTER TABLE video_jobs ADD COLUMN attempts INT NOT NULL DEFAULT 0;
@@ -0,0 +1,297 @@
+"""
+Model Registry
+Loads each YOLO model once per process, warms it up and shares it between
+the Flask routes, video detection and realtime detection.
+MODEL_BACKEND selects PyTorch weights or the ONNX / OpenVINO artifacts
+written by export_models.py, for every one of those paths at once.
+Also provides a micro-batching executor that groups images coming from
+concurrent requests into a single batched model call.
+"""
+
+from ultralytics import YOLO
+from concurrent.futures import Future
+from functools import lru_cache
+from metrics import Gauge
+import hashlib
+import numpy as np
+import threading
+import queue
+import time
+import os
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Model locations (can be overridden from .env)
+MODEL_PATHS = {
+    "pb": os.environ.get("PB_MODEL_PATH", "yolov8n.pt"),  # person + bike
+    "helmet": os.environ.get(
+        "HELMET_MODEL_PATH", os.path.join(BASE_DIR, "yolov8", "best.pt")
+    ),  # helmet
+}
+
+# Inference backend: "pytorch", "onnx" or "openvino"
+# (create the artifacts first: python export_models.py export --format onnx)
+MODEL_BACKEND = os.environ.get("MODEL_BACKEND", "pytorch").lower()
+# Load the INT8-quantized artifacts of that backend
+MODEL_INT8 = os.environ.get("MODEL_INT8", "False").lower() == "true"
+
+BACKENDS = ("pytorch", "onnx", "openvino")
+
+# Micro-batching configuration
+BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", "8"))
+BATCH_MAX_WAIT_MS = float(os.environ.get("BATCH_MAX_WAIT_MS", "20"))
+
+WARMUP_SIZE = 640
+
+_models = {}
+_model_locks = {name: threading.Lock() for name in MODEL_PATHS}
+_registry_lock = threading.Lock()
+
+
+def _warmup(model):
+    dummy = np.zeros((WARMUP_SIZE, WARMUP_SIZE, 3), dtype=np.uint8)
+    try:
+        model(dummy, verbose=False)
+    except Exception as e:
+        print("Model warmup error:", e)
+
+
+def model_path(name, backend=None, int8=None):
+    """
+    Location of a model for a backend, next to its PyTorch weights:
+
+        best.pt -> best.onnx / best_int8.onnx
+                -> best_openvino_model/ / best_int8_openvino_model/
+
+    Returns:
+        str: Weights file or OpenVINO model directory
+    """
+    backend = backend or MODEL_BACKEND
+    int8 = MODEL_INT8 if int8 is None else int8
+    path = MODEL_PATHS[name]
+    if backend == "pytorch":
+        return path
+    stem = os.path.splitext(path)[0] + ("_int8" if int8 else "")
+    if backend == "onnx":
+        return stem + ".onnx"
+    if backend == "openvino":
+        return stem + "_openvino_model"
+    raise ValueError(f"Unknown model backend: {backend} (expected one of {BACKENDS})")
+
+
+def get_model(name):
+    """
+    Return the shared model instance, loading and warming it on first use
+
+    Args:
+        name (str): "pb" (person + bike) or "helmet"
+
+    Returns:
+        YOLO: Loaded model (ultralytics picks the runtime from the path)
+    """
+    model = _models.get(name)
+    if model is not None:
+        return model
+
+    with _registry_lock:
+        model = _models.get(name)
+        if model is None:
+            path = model_path(name)
+            if MODEL_BACKEND != "pytorch" and not os.path.exists(path):
+                raise FileNotFoundError(
+                    f"{path} not found, run: python export_models.py export "
+                    f"--format {MODEL_BACKEND}" + (" --int8" if MODEL_INT8 else "")
+                )
+            model = YOLO(path, task="detect")
+            _warmup(model)
+            _models[name] = model
+    return model
+
+
+def load_all():
+    """
+    Load and warm up every registered model (called at app startup)
+    """
+    for name in MODEL_PATHS:
+        get_model(name)
+
+
+def model_versions():
+    """
+    Identify the weights currently configured (for the selected backend),
+    for cache keys
+
+    Returns:
+        str: "name=<sha1 prefix>" for every model, comma-separated
+            (the path itself for hub names that are not local files)
+    """
+    versions = []
+    for name in sorted(MODEL_PATHS):
+        path = _weights_file(model_path(name))
+        try:
+            st = os.stat(path)
+            versions.append(f"{name}={_file_digest(path, st.st_mtime_ns, st.st_size)}")
+        except OSError:
+            versions.append(f"{name}={path}")
+    return ",".join(versions)
+
+
+def _weights_file(path):
+    # OpenVINO models are directories; the weights are in the .bin file
+    if os.path.isdir(path):
+        for entry in sorted(os.listdir(path)):
+            if entry.endswith(".bin"):
+                return os.path.join(path, entry)
+    return path
+
+
+@lru_cache(maxsize=16)
+def _file_digest(path, mtime_ns, size):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+
+def get_pb_model():
+    return get_model("pb")
+
+
+def get_helmet_model():
+    return get_model("helmet")
+
+
+def predict(name, source, **kwargs):
+    """
+    Run a shared model on one image or a list of images
+
+    YOLO predictors are not safe to call from several threads at once, so
+    every call to the same model is serialized here.
+
+    Args:
+        name (str): Model name in MODEL_PATHS
+        source: Image (numpy array) or list of images
+        **kwargs: Extra arguments forwarded to the model call
+
+    Returns:
+        list: One ultralytics Results object per input image
+    """
+    model = get_model(name)
+    kwargs.setdefault("verbose", False)
+    with _model_locks[name]:
+        return model(source, **kwargs)
+
+
+class MicroBatcher:
+    """
+    Collects images submitted from many threads and runs them through
+    `batch_fn` together, flushing when `max_batch_size` images are waiting
+    or when the oldest one has waited `max_wait_ms`.
+    """
+
+    def __init__(
+        self,
+        batch_fn,
+        max_batch_size=BATCH_MAX_SIZE,
+        max_wait_ms=BATCH_MAX_WAIT_MS,
+    ):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="micro-batcher", daemon=True
+                )
+                self._thread.start()
+
+    def submit(self, image):
+        """
+        Queue an image for the next batch
+
+        Returns:
+            Future: Resolves to the batch_fn output for this image
+        """
+        self._ensure_started()
+        future = Future()
+        self._queue.put((image, future))
+        return future
+
+    def predict(self, image, timeout=None):
+        return self.submit(image).result(timeout)
+
+    def shutdown(self):
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self._thread = None
+
+    def _collect(self, first):
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                # Put the stop marker back so the loop exits after this batch
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+
+            batch = self._collect(first)
+            images = [image for image, _ in batch]
+            try:
+                outputs = self.batch_fn(images)
+            except Exception as e:
+                print("Micro-batch inference error:", e)
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            for (_, future), output in zip(batch, outputs):
+                future.set_result(output)
+
+
+_batcher = None
+
+BATCHER_QUEUE_DEPTH = Gauge(
+    "helmettrack_batcher_queue_depth",
+    "Images waiting for the /predict_image micro-batcher",
+    callback=lambda: {(): _batcher._queue.qsize() if _batcher is not None else 0},
+)
+
+
+def get_batcher():
+    """
+    Return the process-wide MicroBatcher used by /predict_image
+
+    Each submitted image resolves to its (persons, bikes, no_helmets) tuple.
+    """
+    global _batcher
+    if _batcher is None:
+        from cascade import detect_frames
+
+        with _registry_lock:
+            if _batcher is None:
+                _batcher = MicroBatcher(detect_frames)
+    return _batcher
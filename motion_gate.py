@@ -0,0 +1,84 @@
+"""
+Motion Gate
+Cheap downscaled frame differencing used to skip model inference on frames
+where nothing in the scene has changed (e.g. empty road).
+"""
+
+import cv2
+import numpy as np
+import os
+
+# Fraction of pixels that must change before a frame is sent to the models
+# (0 disables the gate)
+MOTION_THRESHOLD = float(os.environ.get("MOTION_THRESHOLD", "0.01"))
+# Per-pixel grey level difference counted as a change
+MOTION_PIXEL_DELTA = int(os.environ.get("MOTION_PIXEL_DELTA", "25"))
+# Width of the downscaled frame used for differencing
+MOTION_WIDTH = int(os.environ.get("MOTION_WIDTH", "160"))
+# Run inference anyway after this many consecutive static frames
+MOTION_MAX_SKIP = int(os.environ.get("MOTION_MAX_SKIP", "30"))
+
+
+class MotionGate:
+    """
+    Compares each frame with the last frame that was let through and
+    reports whether enough of it changed to be worth running the models.
+    """
+
+    def __init__(
+        self,
+        threshold=MOTION_THRESHOLD,
+        pixel_delta=MOTION_PIXEL_DELTA,
+        width=MOTION_WIDTH,
+        max_skip=MOTION_MAX_SKIP,
+    ):
+        self.threshold = threshold
+        self.pixel_delta = pixel_delta
+        self.width = width
+        self.max_skip = max_skip
+        self._reference = None
+        self._skipped = 0
+
+    @property
+    def enabled(self):
+        return self.threshold > 0
+
+    def _prepare(self, frame):
+        h, w = frame.shape[:2]
+        height = max(1, int(h * self.width / float(w)))
+        small = cv2.resize(frame, (self.width, height), interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return cv2.GaussianBlur(small, (5, 5), 0)
+
+    def has_motion(self, frame):
+        """
+        Args:
+            frame (numpy.ndarray): BGR frame
+
+        Returns:
+            bool: True if the frame should be sent to the models
+        """
+        if not self.enabled:
+            return True
+
+        small = self._prepare(frame)
+        if self._reference is None or self._reference.shape != small.shape:
+            self._reference = small
+            self._skipped = 0
+            return True
+
+        diff = cv2.absdiff(small, self._reference)
+        changed = np.count_nonzero(diff > self.pixel_delta) / float(diff.size)
+
+        if changed >= self.threshold or self._skipped >= self.max_skip:
+            self._reference = small
+            self._skipped = 0
+            return True
+
+        self._skipped += 1
+        return False
+
+    def reset(self):
+        self._reference = None
+        self._skipped = 0
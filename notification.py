@@ -4,6 +4,16 @@ Handles sending SMS alerts when helmet violations are detected
 """
 
 from twilio.rest import Client
+from twilio.base.exceptions import TwilioRestException
+from concurrent.futures import ThreadPoolExecutor
+from urllib import request as urllib_request, parse as urllib_parse, error as urllib_error
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+import threading
+import base64
+import random
+import json
+import time
 import os
 
 # Twilio Configuration
@@ -12,6 +22,254 @@ TWILIO_ACCOUNT_SID = os.environ.get('TWILIO_ACCOUNT_SID', 'your_account_sid_here
 TWILIO_AUTH_TOKEN = os.environ.get('TWILIO_AUTH_TOKEN', 'your_auth_token_here')
 TWILIO_PHONE_NUMBER = os.environ.get('TWILIO_PHONE_NUMBER', '+1234567890')  # Your Twilio phone number
 
+# Bulk sending configuration
+SMS_MAX_WORKERS = int(os.environ.get('SMS_MAX_WORKERS', '8'))
+SMS_RATE_PER_SECOND = float(os.environ.get('SMS_RATE_PER_SECOND', '5'))  # Token bucket refill rate
+SMS_BURST = int(os.environ.get('SMS_BURST', '10'))  # Token bucket capacity
+SMS_MAX_RETRIES = int(os.environ.get('SMS_MAX_RETRIES', '3'))
+SMS_BACKOFF_SECONDS = float(os.environ.get('SMS_BACKOFF_SECONDS', '0.5'))
+
+
+class SmsTransportError(Exception):
+    """
+    Raised by transports; status is the HTTP status code when known
+    """
+
+    def __init__(self, message, status=None, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value):
+    """
+    Args:
+        value (str): Retry-After header, delay in seconds or an HTTP-date
+
+    Returns:
+        float: Seconds to wait, or None when missing or unparseable (the
+            default backoff applies)
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+class TwilioTransport:
+    """
+    Sends through the Twilio SDK, reusing one Client (and its HTTP session)
+    """
+
+    def __init__(self, account_sid=None, auth_token=None, from_number=None):
+        self.client = Client(account_sid or TWILIO_ACCOUNT_SID, auth_token or TWILIO_AUTH_TOKEN)
+        self.from_number = from_number or TWILIO_PHONE_NUMBER
+
+    def send(self, to, body):
+        try:
+            message = self.client.messages.create(body=body, from_=self.from_number, to=to)
+        except TwilioRestException as e:
+            raise SmsTransportError(str(e), status=e.status)
+        except OSError as e:  # connection errors (requests exceptions are OSErrors)
+            raise SmsTransportError(str(e))
+        return {'message_id': message.sid, 'status': message.status}
+
+
+class HttpTransport:
+    """
+    Posts to a Twilio-compatible Messages endpoint with plain HTTP, e.g. a
+    local stand-in server during tests (base_url="http://127.0.0.1:8080")
+    """
+
+    def __init__(self, base_url, account_sid=None, auth_token=None, from_number=None, timeout=10):
+        self.account_sid = account_sid or TWILIO_ACCOUNT_SID
+        self.url = f"{base_url.rstrip('/')}/2010-04-01/Accounts/{self.account_sid}/Messages.json"
+        token = f"{self.account_sid}:{auth_token or TWILIO_AUTH_TOKEN}".encode()
+        self.auth_header = 'Basic ' + base64.b64encode(token).decode()
+        self.from_number = from_number or TWILIO_PHONE_NUMBER
+        self.timeout = timeout
+
+    def send(self, to, body):
+        data = urllib_parse.urlencode({'To': to, 'From': self.from_number, 'Body': body}).encode()
+        req = urllib_request.Request(self.url, data=data, method='POST')
+        req.add_header('Authorization', self.auth_header)
+        try:
+            with urllib_request.urlopen(req, timeout=self.timeout) as response:
+                payload = json.loads(response.read().decode() or '{}')
+        except urllib_error.HTTPError as e:
+            retry_after = e.headers.get('Retry-After') if e.headers else None
+            raise SmsTransportError(
+                f"HTTP {e.code}: {e.reason}",
+                status=e.code,
+                retry_after=parse_retry_after(retry_after),
+            )
+        except (urllib_error.URLError, OSError) as e:
+            raise SmsTransportError(str(e))
+        return {'message_id': payload.get('sid'), 'status': payload.get('status')}
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: acquire() blocks until a token is available
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = max(1.0, float(capacity))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def _is_retryable(error):
+    # Only transport failures: rate limited, server-side failure, or a
+    # network error (no status). Anything else is a bug or bad input.
+    if not isinstance(error, SmsTransportError):
+        return False
+    status = error.status
+    return status is None or status == 429 or status >= 500
+
+
+def format_phone_number(phone_number):
+    if not phone_number.startswith('+'):
+        phone_number = '+91' + phone_number  # Default to India (+91)
+    return phone_number
+
+
+def build_violation_message(violation_details):
+    """
+    Construct the violation SMS text
+
+    Args:
+        violation_details (dict): Violation information
+
+    Returns:
+        str: Message body
+    """
+    timestamp = violation_details.get('timestamp', 'N/A')
+    fine_amount = violation_details.get('fine_amount', 500)
+
+    return f"""
+HELMET VIOLATION ALERT
+━━━━━━━━━━━━━━━━━━━━━
+A helmet violation has been detected.
+
+📍 Timestamp: {timestamp}
+💰 Fine Amount: ₹{fine_amount}
+⚠️  Action Required: Please pay the fine at your nearest traffic office.
+
+For more details, login to Helmettrack dashboard.
+
+Traffic Safety Division
+        """.strip()
+
+
+class BulkSmsDispatcher:
+    """
+    Sends many SMS concurrently through one transport, limited by a token
+    bucket and retrying 429 / 5xx responses with exponential backoff
+    """
+
+    def __init__(self, transport=None, max_workers=SMS_MAX_WORKERS,
+                 rate_per_second=SMS_RATE_PER_SECOND, burst=SMS_BURST,
+                 max_retries=SMS_MAX_RETRIES, backoff_seconds=SMS_BACKOFF_SECONDS):
+        self.transport = transport or get_sms_transport()
+        self.max_workers = max(1, int(max_workers))
+        self.bucket = TokenBucket(rate_per_second, burst)
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+
+    def send(self, phone_number, body):
+        """
+        Send one SMS with rate limiting and retries
+
+        Returns:
+            dict: Response containing success status and message ID or error
+        """
+        phone_number = format_phone_number(phone_number)
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            try:
+                result = self.transport.send(phone_number, body)
+                result.update({'success': True, 'phone_number': phone_number, 'attempts': attempt + 1})
+                return result
+            except Exception as e:
+                if attempt >= self.max_retries or not _is_retryable(e):
+                    print(f"SMS Error: {str(e)}")
+                    return {'success': False, 'error': str(e), 'phone_number': phone_number,
+                            'attempts': attempt + 1}
+                delay = getattr(e, 'retry_after', None)
+                if delay is None:
+                    delay = self.backoff_seconds * (2 ** attempt) * (1 + random.random() * 0.25)
+                time.sleep(delay)
+                attempt += 1
+
+    def send_bulk(self, phone_numbers, violation_details):
+        """
+        Returns:
+            list: One response dict per phone number, in input order
+        """
+        body = build_violation_message(violation_details)
+        workers = min(self.max_workers, max(1, len(phone_numbers)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(lambda number: self.send(number, body), phone_numbers))
+
+
+_transport = None
+_transport_lock = threading.Lock()
+_dispatcher = None
+
+
+def get_sms_transport():
+    """
+    Returns:
+        Transport shared by every SMS sent from this process. Set
+        SMS_API_BASE_URL to send through HttpTransport instead of Twilio.
+    """
+    global _transport
+    with _transport_lock:
+        if _transport is None:
+            base_url = os.environ.get('SMS_API_BASE_URL')
+            _transport = HttpTransport(base_url) if base_url else TwilioTransport()
+        return _transport
+
+
+def get_sms_dispatcher():
+    """
+    Returns:
+        BulkSmsDispatcher: Shared by every bulk send in this process, so
+        concurrent sends draw from one token bucket (SMS_RATE_PER_SECOND)
+    """
+    global _dispatcher
+    if _dispatcher is None:
+        transport = get_sms_transport()
+        with _transport_lock:
+            if _dispatcher is None:
+                _dispatcher = BulkSmsDispatcher(transport)
+    return _dispatcher
+
 
 def send_violation_sms(phone_number, violation_details):
     """
@@ -28,42 +286,16 @@ def send_violation_sms(phone_number, violation_details):
         dict: Response containing success status and message ID or error
     """
     try:
-        # Initialize Twilio client
-        client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
-        
         # Format phone number if needed
-        if not phone_number.startswith('+'):
-            phone_number = '+91' + phone_number  # Default to India (+91)
-        
-        # Construct violation message
-        timestamp = violation_details.get('timestamp', 'N/A')
-        fine_amount = violation_details.get('fine_amount', 500)
-        
-        message_body = f"""
-HELMET VIOLATION ALERT
-━━━━━━━━━━━━━━━━━━━━━
-A helmet violation has been detected.
+        phone_number = format_phone_number(phone_number)
 
-📍 Timestamp: {timestamp}
-💰 Fine Amount: ₹{fine_amount}
-⚠️  Action Required: Please pay the fine at your nearest traffic office.
+        # Send SMS via the shared transport (one Twilio client per process)
+        result = get_sms_transport().send(phone_number, build_violation_message(violation_details))
 
-For more details, login to Helmettrack dashboard.
-
-Traffic Safety Division
-        """.strip()
-        
-        # Send SMS via Twilio
-        message = client.messages.create(
-            body=message_body,
-            from_=TWILIO_PHONE_NUMBER,
-            to=phone_number
-        )
-        
         return {
             'success': True,
-            'message_id': message.sid,
-            'status': message.status,
+            'message_id': result['message_id'],
+            'status': result['status'],
             'phone_number': phone_number
         }
     
@@ -76,23 +308,21 @@ Traffic Safety Division
         }
 
 
-def send_bulk_violation_sms(phone_numbers, violation_details):
+def send_bulk_violation_sms(phone_numbers, violation_details, dispatcher=None):
     """
     Send SMS to multiple phone numbers for a violation
     
     Args:
         phone_numbers (list): List of phone numbers to notify
         violation_details (dict): Violation information
+        dispatcher (BulkSmsDispatcher): Optional custom dispatcher
+            (transport, concurrency, rate limit); defaults to the shared one
     
     Returns:
-        list: List of response dictionaries for each SMS
+        list: List of response dictionaries for each SMS, in input order
     """
-    results = []
-    for phone_number in phone_numbers:
-        result = send_violation_sms(phone_number, violation_details)
-        results.append(result)
-    
-    return results
+    dispatcher = dispatcher or get_sms_dispatcher()
+    return dispatcher.send_bulk(phone_numbers, violation_details)
 
 
 def validate_phone_number(phone_number):
@@ -3,18 +3,18 @@ Alternative: Send Violation Alerts via Email Instead of SMS
 This is FREE and doesn't require Twilio
 """
 
-from flask import Flask, render_template, request, redirect, session
-from db_connection import get_connection
-from detection.realtime import run_camera_detection
-from detection.video_detect import detect_video
-from ultralytics import YOLO
 import os
-import cv2
-from datetime import datetime
+import atexit
+import socket
+import threading
+import time
 from dotenv import load_dotenv
 import smtplib
 from email.mime.text import MIMEText
+from email.mime.image import MIMEImage
 from email.mime.multipart import MIMEMultipart
+from metrics import SMTP_ERRORS, SMTP_SECONDS
+from thumbnails import ensure_thumbnail
 
 # Load environment variables
 load_dotenv()
@@ -24,69 +24,309 @@ ADMIN_EMAIL = os.environ.get('ADMIN_EMAIL', 'your_email@gmail.com')
 EMAIL_PASSWORD = os.environ.get('EMAIL_PASSWORD', 'your_app_password')
 SEND_EMAIL_ENABLED = os.environ.get('SEND_EMAIL_ENABLED', 'True').lower() == 'true'
 
-def send_violation_email(admin_email, violation_details):
+# SMTP server (defaults to Gmail; point at a local server such as aiosmtpd
+# with SMTP_STARTTLS=False and an empty EMAIL_PASSWORD for testing)
+SMTP_SERVER = os.environ.get('SMTP_SERVER', 'smtp.gmail.com')
+SMTP_PORT = int(os.environ.get('SMTP_PORT', '587'))
+SMTP_STARTTLS = os.environ.get('SMTP_STARTTLS', 'True').lower() == 'true'
+SMTP_TIMEOUT = float(os.environ.get('SMTP_TIMEOUT', '30'))
+# Close the shared session after this many idle seconds
+SMTP_IDLE_SECONDS = float(os.environ.get('SMTP_IDLE_SECONDS', '240'))
+
+# Digest mode: collect violations for this many seconds and send them as one
+# email with thumbnails attached (0 = one email per violation)
+EMAIL_DIGEST_SECONDS = float(os.environ.get('EMAIL_DIGEST_SECONDS', '0'))
+EMAIL_DIGEST_MAX_THUMBNAILS = int(os.environ.get('EMAIL_DIGEST_MAX_THUMBNAILS', '20'))
+
+SUBJECT = "🚨 HELMET VIOLATION DETECTED - HELMETTRACK ALERT"
+LINE = "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━"
+
+
+class Mailer:
     """
-    Send violation alert via email (FREE alternative to SMS)
-    
-    Args:
-        admin_email (str): Admin email address
-        violation_details (dict): Violation information
-    
-    Returns:
-        dict: Success/failure response
+    Keeps one authenticated SMTP session open and reuses it for every
+    message, reconnecting automatically when the server drops it.
     """
-    try:
-        # Gmail SMTP Configuration
-        smtp_server = "smtp.gmail.com"
-        smtp_port = 587
-        
-        # Create message
-        message = MIMEMultipart()
-        message['From'] = ADMIN_EMAIL
-        message['To'] = admin_email
-        message['Subject'] = "🚨 HELMET VIOLATION DETECTED - HELMETTRACK ALERT"
-        
-        timestamp = violation_details.get('timestamp', 'N/A')
-        fine_amount = violation_details.get('fine_amount', 500)
-        
-        body = f"""
+
+    def __init__(self, server=None, port=None, username=None, password=None,
+                 starttls=None, timeout=SMTP_TIMEOUT, idle_seconds=SMTP_IDLE_SECONDS):
+        self.server = server or SMTP_SERVER
+        self.port = port or SMTP_PORT
+        self.username = username if username is not None else ADMIN_EMAIL
+        self.password = password if password is not None else EMAIL_PASSWORD
+        self.starttls = SMTP_STARTTLS if starttls is None else starttls
+        self.timeout = timeout
+        self.idle_seconds = idle_seconds
+        self._smtp = None
+        self._last_used = 0.0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        smtp = smtplib.SMTP(self.server, self.port, timeout=self.timeout)
+        try:
+            if self.starttls:
+                smtp.starttls()
+            if self.password:
+                smtp.login(self.username, self.password)
+        except Exception:
+            smtp.close()
+            raise
+        self._smtp = smtp
+
+    def _disconnect(self):
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except Exception:
+            self._smtp.close()
+        self._smtp = None
+
+    def send(self, message):
+        """
+        Send a MIME message over the shared session
+
+        Args:
+            message (email.message.Message): Message to send
+        """
+        start = time.perf_counter()
+        try:
+            self._send(message)
+        except Exception:
+            SMTP_ERRORS.inc()
+            raise
+        finally:
+            SMTP_SECONDS.observe(value=time.perf_counter() - start)
+
+    def _send(self, message):
+        with self._lock:
+            if self._smtp is not None and time.monotonic() - self._last_used > self.idle_seconds:
+                # Servers drop idle sessions; start fresh instead of failing
+                self._disconnect()
+            for attempt in range(2):
+                if self._smtp is None:
+                    self._connect()
+                try:
+                    self._smtp.send_message(message)
+                    break
+                except (smtplib.SMTPServerDisconnected, ConnectionError, socket.timeout):
+                    # Release the dead socket before reconnecting
+                    try:
+                        self._smtp.close()
+                    except Exception:
+                        pass
+                    self._smtp = None
+                    if attempt:
+                        raise
+                except smtplib.SMTPException as e:
+                    # Refused by the server (e.g. a 5xx for the sender or a
+                    # recipient): the session is still good and resending
+                    # would be refused again or deliver twice
+                    print(f"SMTP refused message: {e}")
+                    self._last_used = time.monotonic()
+                    raise
+            self._last_used = time.monotonic()
+
+    def close(self):
+        with self._lock:
+            self._disconnect()
+
+
+class DigestQueue:
+    """
+    Rolls violations from a time window into a single email
+    """
+
+    def __init__(self, mailer, window_seconds=EMAIL_DIGEST_SECONDS,
+                 max_thumbnails=EMAIL_DIGEST_MAX_THUMBNAILS):
+        self.mailer = mailer
+        self.window_seconds = window_seconds
+        self.max_thumbnails = max_thumbnails
+        self._pending = {}
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def add(self, admin_email, violation_details, image_path=None):
+        with self._lock:
+            self._pending.setdefault(admin_email, []).append((violation_details, image_path))
+            if self._timer is None:
+                self._timer = threading.Timer(self.window_seconds, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        """
+        Send one digest email per recipient for everything collected so far
+
+        Returns:
+            list: Response dict for each digest sent
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = None
+
+        results = []
+        for admin_email, items in pending.items():
+            try:
+                self.mailer.send(_build_digest(admin_email, items, self.max_thumbnails))
+                results.append({
+                    'success': True,
+                    'message': f'Digest of {len(items)} violations sent to {admin_email}',
+                    'email': admin_email
+                })
+            except Exception as e:
+                print(f"Email Error: {str(e)}")
+                results.append({'success': False, 'error': str(e), 'email': admin_email})
+        return results
+
+
+def _build_message(admin_email, violation_details):
+    message = MIMEMultipart()
+    message['From'] = ADMIN_EMAIL
+    message['To'] = admin_email
+    message['Subject'] = SUBJECT
+
+    timestamp = violation_details.get('timestamp', 'N/A')
+    fine_amount = violation_details.get('fine_amount', 500)
+
+    body = f"""
 HELMET VIOLATION ALERT
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+{LINE}
 
 A helmet violation has been detected in your traffic zone.
 
 Details:
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+{LINE}
 📍 Timestamp: {timestamp}
 💰 Fine Amount: ₹{fine_amount}
 ⚠️  Status: VIOLATION RECORDED
 
 Action Required:
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+{LINE}
 1. Login to Helmettrack dashboard
 2. Review the violation details
 3. Take necessary action
 
 Traffic Safety Division
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+{LINE}
 
 This is an automated alert from Helmettrack System.
         """
-        
-        message.attach(MIMEText(body, 'plain'))
-        
-        # Send email via Gmail
-        with smtplib.SMTP(smtp_server, smtp_port) as server:
-            server.starttls()
-            server.login(ADMIN_EMAIL, EMAIL_PASSWORD)
-            server.send_message(message)
-        
+
+    message.attach(MIMEText(body, 'plain'))
+    return message
+
+
+def _thumbnail(image_path):
+    # The thumbnail saved beside the violation image (see thumbnails.py)
+    path = ensure_thumbnail(image_path)
+    if path is None:
+        return None
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def _build_digest(admin_email, items, max_thumbnails):
+    message = MIMEMultipart()
+    message['From'] = ADMIN_EMAIL
+    message['To'] = admin_email
+    message['Subject'] = f"🚨 {len(items)} HELMET VIOLATIONS DETECTED - HELMETTRACK DIGEST"
+
+    total_fine = sum(details.get('fine_amount', 500) for details, _ in items)
+    lines = [
+        f"{i}. 📍 {details.get('timestamp', 'N/A')}  💰 ₹{details.get('fine_amount', 500)}"
+        f"  🖼 {details.get('image', '-')}"
+        for i, (details, _) in enumerate(items, 1)
+    ]
+    body = f"""
+HELMET VIOLATION DIGEST
+{LINE}
+
+{len(items)} helmet violations were detected in your traffic zone.
+💰 Total Fines: ₹{total_fine}
+
+Violations:
+{LINE}
+""" + "\n".join(lines) + f"""
+
+Traffic Safety Division
+{LINE}
+
+This is an automated alert from Helmettrack System.
+"""
+    message.attach(MIMEText(body, 'plain'))
+
+    attached = 0
+    for details, image_path in items:
+        if attached >= max_thumbnails:
+            break
+        if not image_path:
+            continue
+        data = _thumbnail(image_path)
+        if data is None:
+            continue
+        part = MIMEImage(data, 'jpeg')
+        part.add_header('Content-Disposition', 'attachment',
+                        filename=f"thumb_{os.path.basename(image_path)}")
+        message.attach(part)
+        attached += 1
+    return message
+
+
+_mailer = None
+_digest = None
+_shared_lock = threading.Lock()
+
+
+def get_mailer():
+    """
+    Returns:
+        Mailer: Process-wide mailer with a persistent SMTP session
+    """
+    global _mailer
+    with _shared_lock:
+        if _mailer is None:
+            _mailer = Mailer()
+        return _mailer
+
+
+def get_digest_queue():
+    """
+    Returns:
+        DigestQueue: Process-wide digest queue, flushed at interpreter exit
+    """
+    global _digest
+    mailer = get_mailer()
+    with _shared_lock:
+        if _digest is None:
+            _digest = DigestQueue(mailer)
+            atexit.register(_digest.flush)
+        return _digest
+
+
+def send_violation_email(admin_email, violation_details):
+    """
+    Send violation alert via email (FREE alternative to SMS)
+
+    Args:
+        admin_email (str): Admin email address
+        violation_details (dict): Violation information
+
+    Returns:
+        dict: Success/failure response
+    """
+    try:
+        # Reuses the shared SMTP session instead of logging in per email
+        get_mailer().send(_build_message(admin_email, violation_details))
+
         return {
             'success': True,
             'message': f'Email sent to {admin_email}',
             'email': admin_email
         }
-    
+
     except Exception as e:
         print(f"Email Error: {str(e)}")
         return {
@@ -96,6 +336,27 @@ This is an automated alert from Helmettrack System.
         }
 
 
+def notify_violation(admin_email, violation_details, image_path=None):
+    """
+    Alert the admin about a violation, honouring SEND_EMAIL_ENABLED and
+    digest mode (EMAIL_DIGEST_SECONDS)
+
+    Args:
+        admin_email (str): Admin email address
+        violation_details (dict): Violation information
+        image_path (str): Violation image, attached as a thumbnail in digests
+
+    Returns:
+        dict: Success/failure response
+    """
+    if not SEND_EMAIL_ENABLED:
+        return {'success': False, 'error': 'Email alerts disabled', 'email': admin_email}
+    if EMAIL_DIGEST_SECONDS > 0:
+        get_digest_queue().add(admin_email, violation_details, image_path)
+        return {'success': True, 'message': 'Queued for digest', 'email': admin_email}
+    return send_violation_email(admin_email, violation_details)
+
+
 # EXAMPLE USAGE in your app.py:
 """
 # When a violation is detected:
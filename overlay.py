@@ -0,0 +1,137 @@
+"""
+Detection Overlays
+In detections-only mode (DETECTIONS_ONLY=True) the detection loops store
+clean frames plus a small JSON sidecar with the boxes, and the annotated
+view is rendered only when someone asks for it:
+
+    violation_X.jpg           clean frame
+    violation_X.json          sidecar (boxes, confidences, frame index)
+    violation_X.overlay.jpg   rendered on first request, then reused
+"""
+
+from association import Boxes
+import numpy as np
+import json
+import cv2
+import os
+
+# Skip drawing in the detection loops; store sidecars instead
+DETECTIONS_ONLY = os.environ.get("DETECTIONS_ONLY", "False").lower() == "true"
+
+SIDECAR_SUFFIX = ".json"
+OVERLAY_SUFFIX = ".overlay.jpg"
+
+
+def sidecar_path(image_path):
+    return os.path.splitext(image_path)[0] + SIDECAR_SUFFIX
+
+
+def overlay_path(image_path):
+    return os.path.splitext(image_path)[0] + OVERLAY_SUFFIX
+
+
+def _rows(boxes):
+    return [
+        [int(x1), int(y1), int(x2), int(y2), round(float(conf), 4)]
+        for (x1, y1, x2, y2), conf in zip(boxes.xyxy.tolist(), boxes.conf.tolist())
+    ]
+
+
+def _boxes(rows):
+    rows = np.array(rows, dtype=np.float32).reshape(-1, 5)
+    return Boxes(rows[:, :4].astype(np.int32), rows[:, 4])
+
+
+def to_sidecar(detections, frame_index=None, track_id=None, violation=None):
+    """
+    Args:
+        detections (tuple): (persons, bikes, no_helmets) Boxes of the frame
+        violation (dict): The recorded violation (association.associate)
+
+    Returns:
+        dict: JSON-serialisable detections
+    """
+    persons, bikes, no_helmets = detections
+    sidecar = {
+        "frame_index": frame_index,
+        "track_id": track_id,
+        "detections": {
+            "person": _rows(persons),
+            "bike": _rows(bikes),
+            "no_helmet": _rows(no_helmets),
+        },
+    }
+    if violation is not None:
+        sidecar["violation"] = {
+            key: list(violation[key]) for key in ("no_helmet", "person", "bike")
+        }
+        sidecar["violation"]["conf"] = round(float(violation["conf"]), 4)
+    return sidecar
+
+
+def from_sidecar(sidecar):
+    """
+    Returns:
+        tuple: (persons, bikes, no_helmets) Boxes
+    """
+    detections = sidecar["detections"]
+    return tuple(_boxes(detections[k]) for k in ("person", "bike", "no_helmet"))
+
+
+def write_sidecar(image_path, sidecar):
+    with open(sidecar_path(image_path), "w") as f:
+        json.dump(sidecar, f, separators=(",", ":"))
+
+
+def render(frame, detections, violation=False):
+    """
+    Draw detections on a copy of the frame
+
+    Returns:
+        numpy.ndarray: Annotated frame
+    """
+    from video_detect import draw_detections
+
+    frame = frame.copy()
+    draw_detections(frame, *detections)
+    if violation:
+        cv2.putText(
+            frame,
+            "VIOLATION DETECTED",
+            (50, 50),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            1.5,
+            (0, 0, 255),
+            3,
+        )
+    return frame
+
+
+def ensure_overlay(image_path):
+    """
+    Render (once) the annotated version of a stored clean frame
+
+    Returns:
+        str: Path of the overlay image; the image itself when it has no
+            sidecar (already annotated); None if the image is missing
+    """
+    if not os.path.exists(image_path):
+        return None
+    sidecar_file = sidecar_path(image_path)
+    if not os.path.exists(sidecar_file):
+        return image_path
+    path = overlay_path(image_path)
+    if os.path.exists(path):
+        return path
+
+    with open(sidecar_file) as f:
+        sidecar = json.load(f)
+    frame = cv2.imread(image_path)
+    if frame is None:
+        return None
+    annotated = render(frame, from_sidecar(sidecar), "violation" in sidecar)
+
+    tmp_path = f"{path}.{os.getpid()}.tmp.jpg"
+    cv2.imwrite(tmp_path, annotated)
+    os.replace(tmp_path, path)
+    return path
@@ -0,0 +1,108 @@
+"""
+Violation Records
+Keyset-paginated listing of no_helmet_records, newest first. Pages are
+addressed by the (timestamp, id) of the last row shown, so every page is an
+index range scan on idx_no_helmet_records_timestamp_id however deep it is.
+"""
+
+from db_connection import db_cursor
+from datetime import datetime, timedelta
+import os
+
+# Rows per page (the ?limit= parameter is capped at RECORDS_MAX_PAGE_SIZE)
+RECORDS_PAGE_SIZE = int(os.environ.get("RECORDS_PAGE_SIZE", "50"))
+RECORDS_MAX_PAGE_SIZE = int(os.environ.get("RECORDS_MAX_PAGE_SIZE", "500"))
+
+COLUMNS = "id, timestamp, image_name, original_image, violation_image, fine_amount"
+CURSOR_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+
+def encode_cursor(row):
+    return f"{row['timestamp'].strftime(CURSOR_FORMAT)}_{row['id']}"
+
+
+def decode_cursor(cursor):
+    """
+    Returns:
+        tuple: (timestamp, id) of the last row of the previous page
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    stamp, _, record_id = cursor.rpartition("_")
+    return datetime.strptime(stamp, CURSOR_FORMAT), int(record_id)
+
+
+def parse_filters(args):
+    """
+    Read listing filters from request args (date_from / date_to as
+    YYYY-MM-DD, both inclusive; min_fine / max_fine; cursor; limit)
+
+    Raises:
+        ValueError: If a parameter is malformed
+    """
+    filters = {}
+    if args.get("date_from"):
+        filters["date_from"] = datetime.strptime(args["date_from"], "%Y-%m-%d")
+    if args.get("date_to"):
+        filters["date_to"] = datetime.strptime(args["date_to"], "%Y-%m-%d")
+    if args.get("min_fine"):
+        filters["min_fine"] = int(args["min_fine"])
+    if args.get("max_fine"):
+        filters["max_fine"] = int(args["max_fine"])
+    if args.get("cursor"):
+        filters["cursor"] = decode_cursor(args["cursor"])
+    limit = int(args.get("limit") or RECORDS_PAGE_SIZE)
+    filters["limit"] = max(1, min(limit, RECORDS_MAX_PAGE_SIZE))
+    return filters
+
+
+def fetch_page(
+    cursor=None,
+    date_from=None,
+    date_to=None,
+    min_fine=None,
+    max_fine=None,
+    limit=RECORDS_PAGE_SIZE,
+):
+    """
+    Args:
+        cursor (tuple): (timestamp, id) of the last row already shown
+        date_from (datetime): First day included
+        date_to (datetime): Last day included
+
+    Returns:
+        tuple: (list of row dicts, cursor string for the next page or None)
+    """
+    where = []
+    params = []
+    if cursor is not None:
+        # Written so the timestamp part can use the index range
+        where.append("timestamp <= %s AND (timestamp < %s OR id < %s)")
+        params += [cursor[0], cursor[0], cursor[1]]
+    if date_from is not None:
+        where.append("timestamp >= %s")
+        params.append(date_from)
+    if date_to is not None:
+        where.append("timestamp < %s")
+        params.append(date_to + timedelta(days=1))
+    if min_fine is not None:
+        where.append("fine_amount >= %s")
+        params.append(min_fine)
+    if max_fine is not None:
+        where.append("fine_amount <= %s")
+        params.append(max_fine)
+
+    sql = f"SELECT {COLUMNS} FROM no_helmet_records"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    # One extra row tells us whether there is a next page
+    sql += " ORDER BY timestamp DESC, id DESC LIMIT %s"
+    params.append(limit + 1)
+
+    with db_cursor(dictionary=True) as db:
+        db.execute(sql, params)
+        rows = db.fetchall()
+
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
@@ -0,0 +1,97 @@
+"""
+Prediction Result Cache
+Remembers /predict_image results by a hash of the uploaded bytes plus the
+model weights and detection settings, so re-submitting the same image skips
+inference entirely. Least recently used entries are evicted once the entry
+or byte budget is exceeded.
+"""
+
+from collections import OrderedDict
+import threading
+import hashlib
+import os
+
+# Max cached results
+PREDICT_CACHE_MAX_ENTRIES = int(os.environ.get("PREDICT_CACHE_MAX_ENTRIES", "256"))
+# Max total size of cached annotated images (MB)
+PREDICT_CACHE_MAX_MB = float(os.environ.get("PREDICT_CACHE_MAX_MB", "64"))
+
+
+def cache_key(data):
+    """
+    Args:
+        data (bytes): Uploaded image file
+
+    Returns:
+        str: Key that changes when the image, weights or detection settings do
+    """
+    from model_registry import model_versions
+    from cascade import CASCADE_ENABLED, CASCADE_IMGSZ, CASCADE_MARGIN
+
+    digest = hashlib.sha256(data)
+    digest.update(
+        f"|{model_versions()}|{CASCADE_ENABLED}|{CASCADE_IMGSZ}|{CASCADE_MARGIN}".encode()
+    )
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Thread-safe LRU of {key: (detections, annotated JPEG bytes)}
+    """
+
+    def __init__(
+        self,
+        max_entries=PREDICT_CACHE_MAX_ENTRIES,
+        max_bytes=int(PREDICT_CACHE_MAX_MB * 1024 * 1024),
+    ):
+        self.max_entries = max(0, int(max_entries))
+        self.max_bytes = max(0, int(max_bytes))
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        Returns:
+            tuple: (detections, jpeg bytes), or None on a miss
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, detections, jpeg):
+        size = len(jpeg)
+        if not self.max_entries or size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= len(old[1])
+            self._entries[key] = (detections, jpeg)
+            self.bytes += size
+            while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.bytes -= len(evicted)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResultCache()
+        return _cache
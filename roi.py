@@ -0,0 +1,171 @@
+"""
+Per-Source Regions of Interest
+Each source (camera name, or "video" / "camera" for uploads and the local
+webcam) can restrict detection to one or more polygons and set its own
+inference size. Frames are cropped to the bounding box of the polygons and
+everything outside them is blacked out before inference; boxes are mapped
+back to full-frame coordinates afterwards.
+
+Configured in SOURCE_CONFIG (JSON), e.g.:
+
+    {
+        "rtsp://10.0.0.5/stream1": {
+            "roi": [[[0, 400], [1280, 400], [1280, 720], [0, 720]]],
+            "imgsz": 480
+        },
+        "default": {"imgsz": 640}
+    }
+
+Polygon points are pixels, or fractions of the frame size when every
+coordinate is between 0 and 1.
+"""
+
+from association import Boxes
+from cascade import CASCADE_ENABLED, detect_frames
+import numpy as np
+import json
+import cv2
+import os
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SOURCE_CONFIG = os.environ.get("SOURCE_CONFIG", os.path.join(BASE_DIR, "sources.json"))
+
+_config = None
+
+
+class SourceSettings:
+    def __init__(self, name, roi=None, imgsz=None):
+        self.name = name
+        self.polygons = [
+            np.array(p, dtype=np.float32).reshape(-1, 2) for p in roi or []
+        ]
+        self.imgsz = int(imgsz) if imgsz else None
+        self._prepared = {}
+
+    def _for_shape(self, shape):
+        # Crop rectangle and crop-sized mask per frame size, or None when
+        # the polygons cover no part of the frame (full frame is used)
+        if shape[:2] in self._prepared:
+            return self._prepared[shape[:2]]
+        h, w = shape[:2]
+        polygons = []
+        for polygon in self.polygons:
+            if polygon.size and polygon.max() <= 1.0:
+                polygon = polygon * (w, h)
+            polygons.append(np.round(polygon).astype(np.int32))
+
+        # Rasterizing at frame size clips the polygons to the frame
+        full = np.zeros((h, w), dtype=np.uint8)
+        cv2.fillPoly(full, polygons, 255)
+        x, y, crop_w, crop_h = cv2.boundingRect(full)
+        if crop_w == 0 or crop_h == 0:
+            print(
+                f"ROI of source {self.name} lies outside the {w}x{h} frame, "
+                "using the full frame"
+            )
+            self._prepared[shape[:2]] = None
+            return None
+        mask = full[y : y + crop_h, x : x + crop_w].copy()
+        # Skip masking when the polygons fill their bounding box
+        if cv2.countNonZero(mask) == mask.size:
+            mask = None
+        cached = self._prepared[shape[:2]] = ((x, y, x + crop_w, y + crop_h), mask)
+        return cached
+
+    def prepare(self, frame):
+        """
+        Returns:
+            tuple: (image to run the models on, (x, y) offset of that image
+                in the frame)
+        """
+        prepared = self._for_shape(frame.shape) if self.polygons else None
+        if prepared is None:
+            return frame, (0, 0)
+        (x1, y1, x2, y2), mask = prepared
+        crop = frame[y1:y2, x1:x2]
+        if mask is not None:
+            crop = cv2.bitwise_and(crop, crop, mask=mask)
+        return crop, (x1, y1)
+
+
+def load_source_config(path=None):
+    """
+    Returns:
+        dict: {source name: SourceSettings}; empty if the file is missing
+    """
+    path = path or SOURCE_CONFIG
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        raw = json.load(f)
+    return {
+        str(name): SourceSettings(str(name), entry.get("roi"), entry.get("imgsz"))
+        for name, entry in raw.items()
+    }
+
+
+def get_source_settings(name):
+    """
+    Returns:
+        SourceSettings: Settings for this source, the "default" entry, or
+            None when neither is configured
+    """
+    global _config
+    if _config is None:
+        _config = load_source_config()
+    return _config.get(str(name), _config.get("default"))
+
+
+def _shift(boxes, offset):
+    if offset == (0, 0) or not len(boxes.xyxy):
+        return boxes
+    return Boxes(boxes.xyxy + np.array(offset * 2, dtype=np.int32), boxes.conf)
+
+
+def detect(frames, settings, cascade=CASCADE_ENABLED, imgsz=None, helmet=True):
+    """
+    detect_frames with per-source ROI and inference size
+
+    Args:
+        frames (list): BGR images
+        settings: One SourceSettings (or None) for all frames, or a list
+            with one per frame (frames from different cameras)
+        imgsz: Inference size cap (int, or list per frame) applied on top
+            of the source setting, e.g. by a latency budget
+        helmet: Run the helmet pass (bool, or list per frame)
+
+    Returns:
+        list: (persons, bikes, no_helmets) Boxes in full-frame coordinates
+    """
+    if not isinstance(settings, list):
+        settings = [settings] * len(frames)
+    if not isinstance(imgsz, list):
+        imgsz = [imgsz] * len(frames)
+    if not isinstance(helmet, list):
+        helmet = [helmet] * len(frames)
+    if all(s is None for s in settings) and len(set(zip(imgsz, helmet))) == 1:
+        return detect_frames(frames, cascade=cascade, imgsz=imgsz[0], helmet=helmet[0])
+
+    # One model call per inference size / helmet pass combination
+    images = []
+    offsets = []
+    groups = {}
+    for index, (frame, source) in enumerate(zip(frames, settings)):
+        image, offset = source.prepare(frame) if source else (frame, (0, 0))
+        images.append(image)
+        offsets.append(offset)
+        sizes = [s for s in (source and source.imgsz, imgsz[index]) if s]
+        key = (min(sizes) if sizes else None, bool(helmet[index]))
+        groups.setdefault(key, []).append(index)
+
+    results = [None] * len(frames)
+    for (size, run_helmet), indices in groups.items():
+        detections = detect_frames(
+            [images[i] for i in indices],
+            cascade=cascade,
+            imgsz=size,
+            helmet=run_helmet,
+        )
+        for i, boxes in zip(indices, detections):
+            results[i] = tuple(_shift(b, offsets[i]) for b in boxes)
+    return results
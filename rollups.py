@@ -0,0 +1,187 @@
+"""
+Violation Rollups
+Hourly and daily violation counts and fine totals per source (sink or
+camera name). They are updated in the same transaction as every
+no_helmet_records insert, so the dashboard reads a few small rollup rows
+instead of scanning the ever-growing records table.
+
+Usage:
+    python rollups.py backfill   # rebuild both rollups from no_helmet_records
+"""
+
+from db_connection import db_cursor
+from collections import defaultdict
+from datetime import timedelta, datetime
+import argparse
+import os
+
+# Source of rows inserted before sources were recorded
+UNKNOWN_SOURCE = "unknown"
+# Trend lengths shown on the dashboard
+DASHBOARD_HOURS = int(os.environ.get("DASHBOARD_HOURS", "24"))
+DASHBOARD_DAYS = int(os.environ.get("DASHBOARD_DAYS", "30"))
+
+HOURLY_SQL = (
+    "INSERT INTO violation_rollup_hourly (bucket, source, violations, fine_total) "
+    "VALUES (%s, %s, %s, %s) "
+    "ON DUPLICATE KEY UPDATE violations = violations + VALUES(violations), "
+    "fine_total = fine_total + VALUES(fine_total)"
+)
+DAILY_SQL = (
+    "INSERT INTO violation_rollup_daily (day, source, violations, fine_total) "
+    "VALUES (%s, %s, %s, %s) "
+    "ON DUPLICATE KEY UPDATE violations = violations + VALUES(violations), "
+    "fine_total = fine_total + VALUES(fine_total)"
+)
+
+
+def _hour(timestamp):
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+def add_to_rollups(cursor, violations):
+    """
+    Count newly inserted violations; call it with the cursor that inserted
+    them so records and rollups commit (or roll back) together
+
+    Args:
+        violations: (timestamp, source, fine_amount) per inserted row
+    """
+    hourly = defaultdict(lambda: [0, 0])
+    daily = defaultdict(lambda: [0, 0])
+    for timestamp, source, fine_amount in violations:
+        source = source or UNKNOWN_SOURCE
+        for totals in (
+            hourly[(_hour(timestamp), source)],
+            daily[(timestamp.date(), source)],
+        ):
+            totals[0] += 1
+            totals[1] += int(fine_amount or 0)
+    if not hourly:
+        return
+
+    # Sorted keys: concurrent sinks lock rollup rows in the same order
+    cursor.executemany(
+        HOURLY_SQL, [key + tuple(totals) for key, totals in sorted(hourly.items())]
+    )
+    cursor.executemany(
+        DAILY_SQL, [key + tuple(totals) for key, totals in sorted(daily.items())]
+    )
+
+
+def backfill():
+    """
+    Rebuild both rollups from no_helmet_records in one transaction (the
+    scan holds shared locks, so inserts wait instead of being missed)
+
+    Returns:
+        tuple: (hourly rows, daily rows) written
+    """
+    with db_cursor(commit=True) as cursor:
+        cursor.execute("DELETE FROM violation_rollup_hourly")
+        cursor.execute("DELETE FROM violation_rollup_daily")
+        cursor.execute(
+            "INSERT INTO violation_rollup_hourly "
+            "(bucket, source, violations, fine_total) "
+            "SELECT TIMESTAMP(DATE(timestamp), MAKETIME(HOUR(timestamp), 0, 0)), "
+            "COALESCE(source, %s), COUNT(*), COALESCE(SUM(fine_amount), 0) "
+            "FROM no_helmet_records WHERE timestamp IS NOT NULL "
+            "GROUP BY 1, 2",
+            (UNKNOWN_SOURCE,),
+        )
+        hourly = cursor.rowcount
+        cursor.execute(
+            "INSERT INTO violation_rollup_daily "
+            "(day, source, violations, fine_total) "
+            "SELECT DATE(timestamp), COALESCE(source, %s), COUNT(*), "
+            "COALESCE(SUM(fine_amount), 0) "
+            "FROM no_helmet_records WHERE timestamp IS NOT NULL "
+            "GROUP BY 1, 2",
+            (UNKNOWN_SOURCE,),
+        )
+        daily = cursor.rowcount
+    return hourly, daily
+
+
+def _totals(row):
+    # SUM() comes back as Decimal
+    return {
+        "violations": int(row["violations"] or 0),
+        "fine_total": int(row["fine_total"] or 0),
+    }
+
+
+def _series(rows, key, start, step, count):
+    # One entry per hour / day, zeros where nothing was recorded
+    by_key = {row[key]: _totals(row) for row in rows}
+    series = []
+    for i in range(count):
+        point = start + step * i
+        series.append(
+            dict({key: point}, **by_key.get(point, {"violations": 0, "fine_total": 0}))
+        )
+    return series
+
+
+def dashboard_summary(now=None):
+    """
+    Everything the dashboard shows, read from the rollups only
+
+    Returns:
+        dict: totals and today ({violations, fine_total}), hourly and daily
+            trends, and the per-source breakdown of the daily window
+    """
+    now = now or datetime.now()
+    today = now.date()
+    first_hour = _hour(now) - timedelta(hours=DASHBOARD_HOURS - 1)
+    first_day = today - timedelta(days=DASHBOARD_DAYS - 1)
+
+    with db_cursor(dictionary=True) as cursor:
+        cursor.execute(
+            "SELECT SUM(violations) AS violations, SUM(fine_total) AS fine_total "
+            "FROM violation_rollup_daily"
+        )
+        totals = _totals(cursor.fetchone())
+        cursor.execute(
+            "SELECT bucket, SUM(violations) AS violations, "
+            "SUM(fine_total) AS fine_total FROM violation_rollup_hourly "
+            "WHERE bucket >= %s GROUP BY bucket",
+            (first_hour,),
+        )
+        hourly = cursor.fetchall()
+        cursor.execute(
+            "SELECT day, SUM(violations) AS violations, "
+            "SUM(fine_total) AS fine_total FROM violation_rollup_daily "
+            "WHERE day >= %s GROUP BY day",
+            (first_day,),
+        )
+        daily = cursor.fetchall()
+        cursor.execute(
+            "SELECT source, SUM(violations) AS violations, "
+            "SUM(fine_total) AS fine_total FROM violation_rollup_daily "
+            "WHERE day >= %s GROUP BY source ORDER BY violations DESC",
+            (first_day,),
+        )
+        sources = [dict(_totals(row), source=row["source"]) for row in cursor]
+
+    daily = _series(daily, "day", first_day, timedelta(days=1), DASHBOARD_DAYS)
+    return {
+        "totals": totals,
+        "today": {k: daily[-1][k] for k in ("violations", "fine_total")},
+        "hourly": _series(
+            hourly, "bucket", first_hour, timedelta(hours=1), DASHBOARD_HOURS
+        ),
+        "daily": daily,
+        "sources": sources,
+        "days": DASHBOARD_DAYS,
+        "hours": DASHBOARD_HOURS,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Violation rollup tables")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("backfill", help="Rebuild the rollups from no_helmet_records")
+    args = parser.parse_args()
+    hourly, daily = backfill()
+    print(f"Rollups rebuilt: {hourly} hourly rows, {daily} daily rows")
@@ -0,0 +1,253 @@
+"""
+Segment-Parallel Video Detection
+Splits one video into frame ranges and runs each range in its own process,
+then records the violations in video order.
+
+Each segment starts a little before its range (lead-in) and keeps going
+after it until the riders first seen inside the range have left the frame.
+A violation belongs to the segment in which its rider was first seen, so a
+rider crossing a boundary is recorded exactly once.
+
+Usage:
+    python segments.py video.mp4 --processes 8
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from violation_sink import ViolationSink
+import multiprocessing
+import argparse
+import cv2
+import os
+
+# Frames decoded before a segment's range so tracks crossing the boundary
+# are already known (should exceed TRACK_MAX_AGE)
+SEGMENT_OVERLAP_FRAMES = int(os.environ.get("SEGMENT_OVERLAP_FRAMES", "60"))
+# Max frames a segment runs past its range waiting for its tracks to end
+SEGMENT_MAX_TAIL_FRAMES = int(os.environ.get("SEGMENT_MAX_TAIL_FRAMES", "900"))
+# Segments per process (more segments balance uneven content better)
+SEGMENTS_PER_PROCESS = int(os.environ.get("SEGMENTS_PER_PROCESS", "2"))
+
+
+class _SegmentCollector:
+    """
+    Sink stand-in used inside a segment: keeps only the violations this
+    segment owns, JPEG-encoded so they are cheap to send back
+    """
+
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+        self.events = []
+
+    def owns(self, first_seen):
+        return self.start <= first_seen and (self.end is None or first_seen < self.end)
+
+    def submit(self, event, block=True, timeout=None):
+        if not self.owns(event["first_seen"]):
+            return False
+        ok, encoded = cv2.imencode(".jpg", event["frame"])
+        if not ok:
+            print("Failed to encode violation image, frame", event["frame_index"])
+            return False
+        event = dict(event, jpeg=encoded.tobytes())
+        del event["frame"]
+        self.events.append(event)
+        return True
+
+
+def _init_worker(threads):
+    from metrics import start_snapshot_writer
+
+    # Segment metrics are merged into /metrics like the job workers' ones
+    start_snapshot_writer()
+    # One inference thread per core share, so N processes don't oversubscribe
+    cv2.setNumThreads(1)
+    try:
+        import torch
+
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+
+
+def _detect_segment(video_path, start, end, batch_size, stride, motion_gate, cascade):
+    from video_detect import _new_stats, _read_batch, _process_detections
+    from roi import detect, get_source_settings
+    from motion_gate import MotionGate
+    from tracker import ViolationTracker
+
+    gate = MotionGate() if motion_gate else None
+    tracker = ViolationTracker()
+    collector = _SegmentCollector(start, end)
+    stats = _new_stats()
+    settings = get_source_settings("video")
+
+    first = max(0, start - SEGMENT_OVERLAP_FRAMES)
+    cap = cv2.VideoCapture(video_path)
+    if first:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, first)
+    buffer = None
+
+    while True:
+        buffer, count, indices = _read_batch(
+            cap, buffer, batch_size, stride, gate, stats, offset=first
+        )
+        if count == 0:
+            break
+        frames = [buffer[i] for i in range(count)]
+
+        try:
+            detections = detect(frames, settings, cascade=cascade)
+        except Exception as e:
+            print("Video detection model error:", e)
+            continue
+        stats["frames_inferred"] += count
+
+        for frame, frame_index, (persons, bikes, no_helmets) in zip(
+            frames, indices, detections
+        ):
+            _process_detections(
+                frame, persons, bikes, no_helmets, tracker, frame_index, collector
+            )
+
+        if count < batch_size:
+            break
+        position = first + stats["frames_total"]
+        if end is not None and position >= end:
+            # Past the range: continue only while riders first seen inside
+            # it may still turn into violations
+            pending = any(
+                collector.owns(t.first_seen) and not t.emitted for t in tracker.tracks
+            )
+            if not pending or position >= end + SEGMENT_MAX_TAIL_FRAMES:
+                break
+
+    cap.release()
+    for event in tracker.flush():
+        collector.submit(event)
+
+    stats["violations"] = len(collector.events)
+    stats["frames_skipped"] = (
+        stats["frames_skipped_stride"] + stats["frames_skipped_motion"]
+    )
+    return stats, collector.events
+
+
+def split_segments(frame_count, segments):
+    """
+    Returns:
+        list: (start, end) frame ranges; the last end is None (read to EOF,
+            since container frame counts are not always exact)
+    """
+    segments = max(1, min(int(segments), frame_count or 1))
+    size = max(1, frame_count // segments)
+    bounds = [i * size for i in range(segments)] + [None]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def detect_video_parallel(
+    video_path,
+    processes=None,
+    segments=None,
+    batch_size=None,
+    stride=None,
+    motion_gate=True,
+    cascade=None,
+    sink=None,
+    progress=None,
+):
+    """
+    Detect helmet violations in a video file using several processes
+
+    Args:
+        video_path (str): Path to the video
+        processes (int): Worker processes (default: all cores)
+        segments (int): Frame ranges to split the video into
+            (default: SEGMENTS_PER_PROCESS per process)
+        sink (ViolationSink): Where violations go, in video order; a new
+            sink is created (and flushed on return) when not given
+        progress (callable): Called with the merged stats as segments finish
+        Other arguments are passed through as in video_detect.detect_video
+
+    Returns:
+        dict: Frame counters summed over segments (overlap frames are counted
+            by both neighbouring segments) and the number of violations
+    """
+    from video_detect import VIDEO_BATCH_SIZE, VIDEO_FRAME_STRIDE, _new_stats
+    from cascade import CASCADE_ENABLED
+
+    processes = max(1, int(processes or os.cpu_count() or 1))
+    batch_size = max(1, int(batch_size or VIDEO_BATCH_SIZE))
+    stride = max(1, int(stride or VIDEO_FRAME_STRIDE))
+    cascade = CASCADE_ENABLED if cascade is None else cascade
+
+    cap = cv2.VideoCapture(video_path)
+    frame_count = max(0, int(cap.get(cv2.CAP_PROP_FRAME_COUNT)))
+    cap.release()
+    ranges = split_segments(frame_count, segments or processes * SEGMENTS_PER_PROCESS)
+
+    stats = _new_stats()
+    stats["frames_expected"] = frame_count
+    stats["segments"] = len(ranges)
+    events = []
+    threads = max(1, (os.cpu_count() or 1) // processes)
+    with ProcessPoolExecutor(
+        max_workers=min(processes, len(ranges)),
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(threads,),
+    ) as pool:
+        futures = [
+            pool.submit(
+                _detect_segment,
+                video_path,
+                start,
+                end,
+                batch_size,
+                stride,
+                motion_gate,
+                cascade,
+            )
+            for start, end in ranges
+        ]
+        for future in futures:
+            segment_stats, segment_events = future.result()
+            for key, value in segment_stats.items():
+                stats[key] += value
+            events.extend(segment_events)
+            if progress is not None:
+                progress(stats)
+
+    # Record in video order regardless of which segment finished first
+    events.sort(key=lambda e: (e["frame_index"], e["track_id"]))
+    own_sink = sink is None
+    if own_sink:
+        sink = ViolationSink(name="video")
+    for track_id, event in enumerate(events, 1):
+        # Track ids restart in every segment; renumber so they stay unique
+        event["track_id"] = track_id
+        sink.submit(event)
+    if own_sink:
+        sink.close()
+
+    print(
+        "Video processed in {segments} segments: {frames_total} frames, "
+        "{frames_inferred} inferred, {frames_skipped} skipped, "
+        "{violations} violations".format(**stats)
+    )
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Segment-parallel video detection")
+    parser.add_argument("video")
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--segments", type=int, default=None)
+    parser.add_argument("--stride", type=int, default=None)
+    args = parser.parse_args()
+    detect_video_parallel(
+        args.video,
+        processes=args.processes,
+        segments=args.segments,
+        stride=args.stride,
+    )
@@ -0,0 +1,501 @@
+"""
+Multi-Stream Realtime Engine
+Headless detection over many cameras at once. One capture thread per source
+keeps only its latest frame (older frames are overwritten, never queued) and
+a single scheduler batches the fresh frames of all cameras into shared model
+calls, so latency stays bounded however many cameras are attached.
+
+Usage:
+    python streams.py 0 rtsp://10.0.0.5/stream1 junction.mp4
+"""
+
+from cascade import CASCADE_ENABLED
+from tracker import ViolationTracker
+from roi import detect, get_source_settings
+from latency_budget import LATENCY_TARGET_MS, make_controller
+from violation_sink import ViolationSink
+from overlay import DETECTIONS_ONLY, render as render_overlay
+from metrics import FRAMES, STAGE_SECONDS, STREAM_LATENCY_SECONDS, RateMeter
+import threading
+import argparse
+import time
+import cv2
+import os
+
+# Comma-separated sources used by /start_camera: device indices, RTSP URLs
+# or video files (played at their real-time rate)
+STREAM_SOURCES = os.environ.get("STREAM_SOURCES", "0")
+# Max frames (one per camera) per batched model call
+STREAM_BATCH_SIZE = int(os.environ.get("STREAM_BATCH_SIZE", "16"))
+# Frames older than this when the scheduler reaches them are dropped
+STREAM_MAX_LATENCY_MS = float(os.environ.get("STREAM_MAX_LATENCY_MS", "500"))
+# Seconds between reconnect attempts for a dropped camera
+STREAM_RECONNECT_SECONDS = float(os.environ.get("STREAM_RECONNECT_SECONDS", "2.0"))
+# JPEG quality of the MJPEG live view
+LIVE_JPEG_QUALITY = int(os.environ.get("LIVE_JPEG_QUALITY", "80"))
+
+
+def parse_source(source):
+    """
+    "0" -> device 0, anything else is passed to cv2.VideoCapture as is
+    """
+    source = str(source).strip()
+    return int(source) if source.isdigit() else source
+
+
+class FrameSource:
+    """
+    Capture thread for one camera. Only the newest frame is kept; a frame
+    the scheduler did not take in time is replaced and counted as dropped.
+    """
+
+    def __init__(self, source, name=None, notify=None):
+        self.source = parse_source(source)
+        self.name = name or str(source)
+        self.is_file = isinstance(self.source, str) and os.path.isfile(self.source)
+        self.finished = False
+        self.captured = 0
+        self.dropped = 0
+        self._notify = notify
+        self._latest = None
+        self._lock = threading.Lock()
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(
+            target=self._run, name=f"capture-{self.name}", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+
+    def take(self):
+        """
+        Returns:
+            tuple: (frame, frame_index, captured_at) of the newest frame not
+                taken yet, or None
+        """
+        with self._lock:
+            latest, self._latest = self._latest, None
+        return latest
+
+    def _put(self, frame, frame_index):
+        with self._lock:
+            if self._latest is not None:
+                self.dropped += 1
+                FRAMES.inc(self.name, "dropped")
+            self._latest = (frame, frame_index, time.monotonic())
+            self.captured += 1
+        if self._notify is not None:
+            self._notify()
+
+    def _run(self):
+        frame_index = 0
+        while self._running:
+            cap = cv2.VideoCapture(self.source)
+            if not cap.isOpened():
+                print("Could not open stream:", self.name)
+                if self.is_file:
+                    break
+                time.sleep(STREAM_RECONNECT_SECONDS)
+                continue
+
+            # Files are paced to their frame rate so they behave like cameras
+            fps = cap.get(cv2.CAP_PROP_FPS) if self.is_file else 0
+            interval = 1.0 / fps if fps and fps > 0 else 0.0
+            started = time.monotonic()
+            played = 0
+
+            while self._running:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                self._put(frame, frame_index)
+                frame_index += 1
+                if interval:
+                    played += 1
+                    delay = started + played * interval - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+            cap.release()
+
+            if self.is_file:
+                break
+            if self._running:
+                print("Stream lost, reconnecting:", self.name)
+                time.sleep(STREAM_RECONNECT_SECONDS)
+        self.finished = True
+        if self._notify is not None:
+            self._notify()
+
+
+class FrameBroadcaster:
+    """
+    Fans the annotated frames of one camera out to any number of MJPEG
+    viewers. Publishing only stores a reference; the first viewer to ask
+    for a frame encodes it and every other viewer reuses those bytes.
+    A viewer that falls behind simply gets the newest frame next, so slow
+    clients skip frames instead of slowing the detector down.
+    """
+
+    def __init__(self, quality=LIVE_JPEG_QUALITY):
+        self.quality = quality
+        self.viewers = 0
+        self.encoded = 0
+        self._frame = None
+        self._detections = None
+        self._seq = 0
+        self._jpeg = None
+        self._jpeg_seq = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._encode_lock = threading.Lock()
+
+    def publish(self, frame, detections=None):
+        """
+        Args:
+            frame (numpy.ndarray): Annotated frame, or a clean frame plus its
+                detections (detections-only mode), drawn only if watched
+        """
+        with self._cond:
+            self._frame = frame
+            self._detections = detections
+            self._seq += 1
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def wait(self, last_seq, timeout=1.0):
+        """
+        Wait for a frame newer than last_seq
+
+        Returns:
+            tuple: (jpeg bytes, seq), or (None, last_seq) on timeout / close
+        """
+        with self._cond:
+            if not self._cond.wait_for(
+                lambda: self._seq != last_seq or self._closed, timeout
+            ):
+                return None, last_seq
+            if self._seq == last_seq:
+                return None, last_seq
+            frame, detections, seq = self._frame, self._detections, self._seq
+
+        with self._encode_lock:
+            if self._jpeg_seq < seq:
+                if detections is not None:
+                    frame = render_overlay(frame, detections)
+                ok, encoded = cv2.imencode(
+                    ".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality]
+                )
+                if not ok:
+                    return None, seq
+                self._jpeg = encoded.tobytes()
+                self._jpeg_seq = seq
+                self.encoded += 1
+            return self._jpeg, self._jpeg_seq
+
+    def mjpeg(self):
+        """
+        Generator for a multipart/x-mixed-replace; boundary=frame response
+        """
+        with self._cond:
+            self.viewers += 1
+        try:
+            seq = 0
+            while not self._closed:
+                jpeg, seq = self.wait(seq)
+                if jpeg is None:
+                    continue
+                yield (
+                    b"--frame\r\nContent-Type: image/jpeg\r\nContent-Length: "
+                    + str(len(jpeg)).encode()
+                    + b"\r\n\r\n"
+                    + jpeg
+                    + b"\r\n"
+                )
+        finally:
+            with self._cond:
+                self.viewers -= 1
+
+
+class _StreamState:
+    def __init__(self, source, latency_target_ms=LATENCY_TARGET_MS):
+        self.source = source
+        self.broadcaster = FrameBroadcaster()
+        self.tracker = ViolationTracker()
+        self.processed = 0
+        self.stale = 0
+        self.violations = 0
+        self.latency_ms = 0.0
+        self.rate = RateMeter(source.name)
+        self.settings = get_source_settings(source.name)
+        # Per-camera stride / inference size / helmet pass under load
+        self.budget = make_controller(source.name, latency_target_ms)
+
+
+class StreamEngine:
+    """
+    Usage:
+        engine = StreamEngine(["0", "rtsp://..."]).start()
+        ...
+        engine.stop()
+    """
+
+    def __init__(
+        self,
+        sources,
+        batch_size=STREAM_BATCH_SIZE,
+        max_latency_ms=STREAM_MAX_LATENCY_MS,
+        cascade=CASCADE_ENABLED,
+        sink=None,
+        latency_target_ms=LATENCY_TARGET_MS,
+    ):
+        self.batch_size = max(1, int(batch_size))
+        self.max_latency = max_latency_ms / 1000.0
+        self.cascade = cascade
+        self.sink = sink
+        self._own_sink = sink is None
+        self._wakeup = threading.Condition()
+        self._fresh = False
+        self._running = False
+        self._thread = None
+        self._next = 0
+        self.batches = 0
+
+        self.streams = []
+        names = set()
+        for source in sources:
+            name = str(source)
+            while name in names:
+                name += "'"
+            names.add(name)
+            self.streams.append(
+                _StreamState(FrameSource(source, name, self._signal), latency_target_ms)
+            )
+
+    def _signal(self):
+        with self._wakeup:
+            self._fresh = True
+            self._wakeup.notify()
+
+    def start(self):
+        if self._own_sink:
+            self.sink = ViolationSink(name="streams")
+        self._running = True
+        for state in self.streams:
+            state.source.start()
+        self._thread = threading.Thread(
+            target=self._run, name="stream-scheduler", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stop capture and scheduling, then record violations still held by
+        the trackers
+        """
+        if not self._running:
+            return
+        self._running = False
+        for state in self.streams:
+            state.source.stop()
+        self._signal()
+        self._thread.join()
+        for state in self.streams:
+            state.broadcaster.close()
+        for state in self.streams:
+            for event in state.tracker.flush():
+                self.sink.submit(event)
+        if self._own_sink:
+            self.sink.close()
+
+    def is_running(self):
+        return self._running and any(not s.source.finished for s in self.streams)
+
+    def status(self):
+        """
+        Returns:
+            dict: Per-camera counters, latency of the last processed frame
+                and the latency budget decisions
+        """
+        return {
+            "running": self.is_running(),
+            "batches": self.batches,
+            "streams": [
+                {
+                    "name": state.source.name,
+                    "finished": state.source.finished,
+                    "captured": state.source.captured,
+                    "dropped": state.source.dropped,
+                    "stale": state.stale,
+                    "processed": state.processed,
+                    "violations": state.violations,
+                    "latency_ms": round(state.latency_ms, 1),
+                    "viewers": state.broadcaster.viewers,
+                    "budget": state.budget.status() if state.budget else None,
+                }
+                for state in self.streams
+            ],
+        }
+
+    # -------------------------
+    # SCHEDULER
+    # -------------------------
+    def _collect(self):
+        # Round-robin start so no camera is always last when batches are full
+        batch = []
+        count = len(self.streams)
+        start = self._next
+        self._next = (start + 1) % count
+        now = time.monotonic()
+        for i in range(count):
+            state = self.streams[(start + i) % count]
+            item = state.source.take()
+            if item is None:
+                continue
+            if now - item[2] > self.max_latency:
+                state.stale += 1
+                FRAMES.inc(state.source.name, "stale")
+                continue
+            if state.budget is not None and not state.budget.admit():
+                FRAMES.inc(state.source.name, "skipped_stride")
+                continue
+            batch.append((state,) + item)
+            if len(batch) >= self.batch_size:
+                break
+        return batch
+
+    def _run(self):
+        from video_detect import _process_detections
+
+        while self._running:
+            with self._wakeup:
+                while not self._fresh and self._running:
+                    self._wakeup.wait(0.5)
+                self._fresh = False
+
+            # Keep going while frames remain (batches may have been capped)
+            while self._running:
+                batch = self._collect()
+                if not batch:
+                    break
+                budgets = [state.budget for state, _, _, _ in batch]
+                started = time.monotonic()
+                try:
+                    # Cameras with different inference sizes are batched
+                    # separately inside detect()
+                    detections = detect(
+                        [frame for _, frame, _, _ in batch],
+                        [state.settings for state, _, _, _ in batch],
+                        cascade=self.cascade,
+                        imgsz=[b.imgsz if b else None for b in budgets],
+                        helmet=[b.helmet if b else True for b in budgets],
+                    )
+                except Exception as e:
+                    print("Stream detection model error:", e)
+                    continue
+                self.batches += 1
+                inferred_at = time.monotonic()
+
+                for (state, frame, frame_index, captured_at), result in zip(
+                    batch, detections
+                ):
+                    persons, bikes, no_helmets = result
+                    # Never block the scheduler on violation recording
+                    with STAGE_SECONDS.time("postprocess"):
+                        state.violations += _process_detections(
+                            frame,
+                            persons,
+                            bikes,
+                            no_helmets,
+                            state.tracker,
+                            frame_index,
+                            self.sink,
+                            block=False,
+                            source=state.source.name,
+                        )
+                    state.broadcaster.publish(
+                        frame, (persons, bikes, no_helmets) if DETECTIONS_ONLY else None
+                    )
+                    state.processed += 1
+                    latency = time.monotonic() - captured_at
+                    state.latency_ms = latency * 1000.0
+                    name = state.source.name
+                    FRAMES.inc(name, "inferred")
+                    STREAM_LATENCY_SECONDS.observe(name, value=latency)
+                    state.rate.add(1)
+                    if state.budget is not None:
+                        # Whole batch inference plus this frame's own work
+                        cost = time.monotonic() - inferred_at
+                        state.budget.observe(latency, inferred_at - started + cost)
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    return _engine
+
+
+def start_engine(sources=None):
+    """
+    Start the process-wide engine (no-op if it is already running)
+
+    Args:
+        sources (list): Defaults to STREAM_SOURCES
+
+    Returns:
+        StreamEngine: The running engine
+    """
+    global _engine
+    with _engine_lock:
+        if _engine is not None and _engine.is_running():
+            return _engine
+        if _engine is not None:
+            _engine.stop()
+        if sources is None:
+            sources = [s for s in STREAM_SOURCES.split(",") if s.strip()]
+        _engine = StreamEngine(sources).start()
+        return _engine
+
+
+def stop_engine():
+    global _engine
+    with _engine_lock:
+        if _engine is not None:
+            _engine.stop()
+        _engine = None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Headless multi-camera detection")
+    parser.add_argument("sources", nargs="+")
+    args = parser.parse_args()
+
+    from model_registry import load_all
+
+    load_all()
+    engine = StreamEngine(args.sources).start()
+    try:
+        while engine.is_running():
+            time.sleep(5)
+            for stream in engine.status()["streams"]:
+                print(
+                    "{name}: processed={processed} dropped={dropped} "
+                    "stale={stale} violations={violations} "
+                    "latency={latency_ms}ms".format(**stream)
+                )
+    except KeyboardInterrupt:
+        pass
+    engine.stop()
@@ -0,0 +1,145 @@
+"""
+Violation Thumbnails
+Small JPEG previews stored beside the full images (name.jpg ->
+name.thumb.jpg) so listings do not download full frames. Thumbnails are
+written when a violation is saved, created on first request for older
+images, or in bulk with:
+
+    python thumbnails.py backfill
+"""
+
+from functools import lru_cache
+from overlay import OVERLAY_SUFFIX
+import hashlib
+import argparse
+import cv2
+import os
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# Folders under static/ whose images get thumbnails
+THUMBNAIL_FOLDERS = {
+    "violations": os.path.join(BASE_DIR, "static", "violations"),
+    "uploads": os.path.join(BASE_DIR, "static", "uploads"),
+}
+
+THUMBNAIL_WIDTH = int(os.environ.get("THUMBNAIL_WIDTH", "320"))
+THUMBNAIL_QUALITY = int(os.environ.get("THUMBNAIL_QUALITY", "75"))
+THUMBNAIL_SUFFIX = ".thumb.jpg"
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+
+def thumbnail_path(image_path):
+    return os.path.splitext(image_path)[0] + THUMBNAIL_SUFFIX
+
+
+def is_thumbnail(filename):
+    return filename.endswith(THUMBNAIL_SUFFIX)
+
+
+def make_thumbnail(image_path, image=None):
+    """
+    Write the thumbnail of an image
+
+    Args:
+        image_path (str): Full-size image; the thumbnail is written beside it
+        image (numpy.ndarray): The already decoded image, to skip reading
+            it back from disk
+
+    Returns:
+        str: Thumbnail path, or None if the image could not be read
+    """
+    if image is None:
+        image = cv2.imread(image_path)
+        if image is None:
+            return None
+    h, w = image.shape[:2]
+    if w > THUMBNAIL_WIDTH:
+        image = cv2.resize(
+            image,
+            (THUMBNAIL_WIDTH, max(1, int(h * THUMBNAIL_WIDTH / w))),
+            interpolation=cv2.INTER_AREA,
+        )
+    ok, encoded = cv2.imencode(
+        ".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, THUMBNAIL_QUALITY]
+    )
+    if not ok:
+        return None
+
+    # Write then rename so a concurrent request never serves half a file
+    path = thumbnail_path(image_path)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(encoded.tobytes())
+    os.replace(tmp_path, path)
+    return path
+
+
+def ensure_thumbnail(image_path):
+    """
+    Returns:
+        str: Thumbnail path, created now if missing or older than the image;
+            None if the image does not exist or cannot be read
+    """
+    path = thumbnail_path(image_path)
+    try:
+        image_mtime = os.stat(image_path).st_mtime_ns
+    except OSError:
+        return None
+    try:
+        if os.stat(path).st_mtime_ns >= image_mtime:
+            return path
+    except OSError:
+        pass
+    return make_thumbnail(image_path)
+
+
+@lru_cache(maxsize=4096)
+def _etag(path, mtime_ns, size):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def content_etag(path):
+    """
+    Returns:
+        str: SHA-1 of the file contents, hashed once per file version
+    """
+    st = os.stat(path)
+    return _etag(path, st.st_mtime_ns, st.st_size)
+
+
+def backfill(folders=None):
+    """
+    Create the missing thumbnails of every image in the given folders
+
+    Returns:
+        int: Number of thumbnails written
+    """
+    written = 0
+    for folder in folders or THUMBNAIL_FOLDERS.values():
+        if not os.path.isdir(folder):
+            continue
+        for name in sorted(os.listdir(folder)):
+            if is_thumbnail(name) or not name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            if name.endswith(OVERLAY_SUFFIX):
+                continue
+            image_path = os.path.join(folder, name)
+            if os.path.exists(thumbnail_path(image_path)):
+                continue
+            if make_thumbnail(image_path) is None:
+                print("Could not create thumbnail:", image_path)
+            else:
+                written += 1
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Violation image thumbnails")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("backfill", help="Create thumbnails for existing images")
+    args = parser.parse_args()
+    print("Thumbnails written:", backfill())
@@ -0,0 +1,220 @@
+"""
+Rider Tracker
+Lightweight IoU / centroid tracker that follows riders across frames so a
+helmet violation is recorded once per rider instead of once per frame.
+"""
+
+from association import associate, rider_mask
+import numpy as np
+import os
+
+# Consecutive violating frames needed to confirm a violation
+TRACK_CONFIRM_FRAMES = int(os.environ.get("TRACK_CONFIRM_FRAMES", "3"))
+# Minimum IoU to continue a track
+TRACK_IOU_THRESHOLD = float(os.environ.get("TRACK_IOU_THRESHOLD", "0.3"))
+# Frames a track survives without being matched
+TRACK_MAX_AGE = int(os.environ.get("TRACK_MAX_AGE", "30"))
+# Frames a confirmed violation is held to find a better frame before it is emitted
+TRACK_MAX_HOLD = int(os.environ.get("TRACK_MAX_HOLD", "60"))
+# Centroid fallback: max distance as a fraction of the box diagonal
+TRACK_CENTROID_RATIO = float(os.environ.get("TRACK_CENTROID_RATIO", "0.5"))
+
+
+def iou_matrix(a, b):
+    """
+    Returns:
+        numpy.ndarray: (len(a), len(b)) IoU of every box pair
+    """
+    a = a.astype(np.float32)
+    b = b.astype(np.float32)
+    top_left = np.maximum(a[:, None, :2], b[None, :, :2])
+    bottom_right = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    inter = np.clip(bottom_right - top_left, 0, None).prod(axis=2)
+    area_a = (a[:, 2:] - a[:, :2]).prod(axis=1)
+    area_b = (b[:, 2:] - b[:, :2]).prod(axis=1)
+    union = area_a[:, None] + area_b[None, :] - inter
+    return inter / np.maximum(union, 1e-6)
+
+
+def _greedy_pairs(score, threshold, higher_is_better=True):
+    # Best score first, each row and column used at most once
+    if not score.size:
+        return []
+    flat = score.ravel()
+    order = np.argsort(-flat if higher_is_better else flat, kind="stable")
+    rows_used = set()
+    cols_used = set()
+    pairs = []
+    for idx in order:
+        value = flat[idx]
+        if (value < threshold) if higher_is_better else (value > threshold):
+            break
+        row, col = divmod(int(idx), score.shape[1])
+        if row in rows_used or col in cols_used:
+            continue
+        rows_used.add(row)
+        cols_used.add(col)
+        pairs.append((row, col))
+    return pairs
+
+
+def match_riders(persons, bikes, no_helmets):
+    """
+    Pair every rider (person on a bike) with its violation, if any
+
+    Returns:
+        tuple: (rider boxes (N, 4), list of violation dict or None per rider)
+    """
+    riders = persons.xyxy[rider_mask(persons, bikes)]
+    by_person = {}
+    for violation in associate(persons, bikes, no_helmets):
+        best = by_person.get(violation["person"])
+        if best is None or violation["conf"] > best["conf"]:
+            by_person[violation["person"]] = violation
+    violations = [by_person.get(tuple(int(v) for v in box)) for box in riders]
+    return riders, violations
+
+
+class Track:
+    def __init__(self, track_id, box, frame_index):
+        self.id = track_id
+        self.box = box
+        self.first_seen = frame_index
+        self.last_seen = frame_index
+        self.streak = 0
+        self.confirmed_at = None
+        self.emitted = False
+        self.best_conf = -1.0
+        self.best_frame = None
+        self.best_frame_index = None
+        self.best_violation = None
+        self.best_detections = None
+
+    def event(self):
+        return {
+            "track_id": self.id,
+            "frame": self.best_frame,
+            "frame_index": self.best_frame_index,
+            "first_seen": self.first_seen,
+            "violation": self.best_violation,
+            "conf": self.best_conf,
+            "detections": self.best_detections,
+        }
+
+
+class ViolationTracker:
+    """
+    Matches rider boxes to existing tracks frame by frame. A violation is
+    confirmed after `confirm_frames` consecutive violating frames and is
+    emitted exactly once per track, carrying the highest-confidence frame.
+    """
+
+    def __init__(
+        self,
+        confirm_frames=TRACK_CONFIRM_FRAMES,
+        iou_threshold=TRACK_IOU_THRESHOLD,
+        max_age=TRACK_MAX_AGE,
+        max_hold=TRACK_MAX_HOLD,
+        centroid_ratio=TRACK_CENTROID_RATIO,
+    ):
+        self.confirm_frames = max(1, int(confirm_frames))
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age
+        self.max_hold = max_hold
+        self.centroid_ratio = centroid_ratio
+        self.tracks = []
+        self._next_id = 1
+
+    def _match(self, boxes):
+        if not self.tracks or not len(boxes):
+            return []
+        track_boxes = np.array([t.box for t in self.tracks], dtype=np.int32)
+        pairs = _greedy_pairs(iou_matrix(track_boxes, boxes), self.iou_threshold)
+
+        # Fall back to centroid distance for fast movers with no overlap
+        free_tracks = [
+            i for i in range(len(self.tracks)) if i not in {r for r, _ in pairs}
+        ]
+        free_boxes = [j for j in range(len(boxes)) if j not in {c for _, c in pairs}]
+        if free_tracks and free_boxes:
+            tb = track_boxes[free_tracks].astype(np.float32)
+            db = boxes[free_boxes].astype(np.float32)
+            tc = (tb[:, :2] + tb[:, 2:]) / 2
+            dc = (db[:, :2] + db[:, 2:]) / 2
+            dist = np.linalg.norm(tc[:, None, :] - dc[None, :, :], axis=2)
+            diag = np.linalg.norm(tb[:, 2:] - tb[:, :2], axis=1)
+            scaled = dist / np.maximum(diag[:, None], 1.0)
+            for r, c in _greedy_pairs(scaled, self.centroid_ratio, False):
+                pairs.append((free_tracks[r], free_boxes[c]))
+        return pairs
+
+    def update(self, boxes, violations, frame, frame_index, detections=None):
+        """
+        Args:
+            boxes (numpy.ndarray): (N, 4) rider boxes in this frame
+            violations (list): Violation dict (from association.associate)
+                or None for each rider
+            frame (numpy.ndarray): Annotated frame, copied when it becomes
+                the best frame of a violating track
+            frame_index (int): Position of the frame in the stream
+            detections (tuple): (persons, bikes, no_helmets) of a clean
+                (unannotated) frame, kept with the best frame for overlays
+
+        Returns:
+            list: Violation events ready to be recorded
+        """
+        boxes = np.asarray(boxes, dtype=np.int32).reshape(-1, 4)
+        matched = dict((c, r) for r, c in self._match(boxes))
+
+        for j in range(len(boxes)):
+            if j in matched:
+                track = self.tracks[matched[j]]
+            else:
+                track = Track(self._next_id, None, frame_index)
+                self._next_id += 1
+                self.tracks.append(track)
+            track.box = tuple(int(v) for v in boxes[j])
+            track.last_seen = frame_index
+
+            violation = violations[j]
+            if violation is None:
+                if track.confirmed_at is None:
+                    track.streak = 0
+                continue
+
+            track.streak += 1
+            if not track.emitted and violation["conf"] > track.best_conf:
+                track.best_conf = violation["conf"]
+                track.best_frame = frame.copy()
+                track.best_frame_index = frame_index
+                track.best_violation = violation
+                track.best_detections = detections
+            if track.confirmed_at is None and track.streak >= self.confirm_frames:
+                track.confirmed_at = frame_index
+
+        events = []
+        alive = []
+        for track in self.tracks:
+            lost = frame_index - track.last_seen > self.max_age
+            ready = track.confirmed_at is not None and not track.emitted
+            if ready and (lost or frame_index - track.confirmed_at >= self.max_hold):
+                events.append(track.event())
+                track.emitted = True
+                track.best_frame = None
+            if not lost:
+                alive.append(track)
+        self.tracks = alive
+        return events
+
+    def flush(self):
+        """
+        Emit every confirmed violation still being held (end of stream)
+        """
+        events = []
+        for track in self.tracks:
+            if track.confirmed_at is not None and not track.emitted:
+                events.append(track.event())
+                track.emitted = True
+                track.best_frame = None
+        self.tracks = []
+        return events
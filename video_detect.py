@@ -1,207 +1,370 @@
-from ultralytics import YOLO
 import cv2
-import time
 import numpy as np
-from db_connection import get_connection
+from cascade import CASCADE_ENABLED
+from motion_gate import MotionGate
+from tracker import ViolationTracker, match_riders
+from violation_sink import ViolationSink
+from metrics import FRAMES, STAGE_SECONDS, RateMeter
+from overlay import DETECTIONS_ONLY
+from roi import detect, get_source_settings
+import threading
+import queue
 import os
 
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-# Load both models
-pb_model = YOLO("yolov8n.pt")  # person + bike detection
-helmet_model = YOLO(
-    os.path.join(BASE_DIR, "..", "yolov8", "best.pt")
-)  # helmet detection
+# Frames per batched model call
+VIDEO_BATCH_SIZE = int(os.environ.get("VIDEO_BATCH_SIZE", "8"))
+# Analyse every Nth frame (1 = every frame)
+VIDEO_FRAME_STRIDE = int(os.environ.get("VIDEO_FRAME_STRIDE", "1"))
+# Batch buffers in flight between the decode, inference and annotate stages
+VIDEO_PREFETCH_BATCHES = int(os.environ.get("VIDEO_PREFETCH_BATCHES", "4"))
 
-VIOLATION_FOLDER = os.path.join(BASE_DIR, "..", "static", "violations")
-os.makedirs(VIOLATION_FOLDER, exist_ok=True)
+_END = object()
 
 
-def _xyxy_from_box(box):
-    try:
-        coords = box.xyxy[0].cpu().numpy()
-    except Exception:
-        coords = box.xyxy[0].numpy()
-    return [float(c) for c in coords]
+def _new_stats():
+    return {
+        "frames_total": 0,
+        "frames_inferred": 0,
+        "frames_skipped": 0,
+        "frames_skipped_stride": 0,
+        "frames_skipped_motion": 0,
+        "frames_expected": 0,
+        "violations": 0,
+    }
 
 
-def detect_video(video_path):
-    cap = cv2.VideoCapture(video_path)
+def _count_frames(source, stats, counted):
+    # Publish frame counters as deltas since the last batch
+    for outcome, key in (
+        ("inferred", "frames_inferred"),
+        ("skipped_stride", "frames_skipped_stride"),
+        ("skipped_motion", "frames_skipped_motion"),
+    ):
+        # Read once: the decode thread keeps incrementing the skip counters
+        value = stats[key]
+        delta = value - counted.get(key, 0)
+        if delta:
+            FRAMES.inc(source, outcome, amount=delta)
+            counted[key] = value
 
-    while True:
-        ret, frame = cap.read()
-        if not ret:
+
+def _read_batch(cap, buffer, batch_size, stride=1, gate=None, stats=None, offset=0):
+    """
+    Decode up to batch_size frames into the preallocated buffer
+
+    Frames between strides are only grabbed (never decoded) and frames the
+    motion gate rejects are dropped before they reach the buffer.
+    Frame indices start at `offset` (the position the capture was seeked to).
+
+    Returns:
+        tuple: (buffer, number of frames read, their frame indices)
+    """
+    if stats is None:
+        stats = _new_stats()
+
+    count = 0
+    indices = []
+    while count < batch_size:
+        # Skip stride - 1 frames without decoding them
+        grabbed = True
+        for _ in range(stride - 1):
+            if not cap.grab():
+                grabbed = False
+                break
+            stats["frames_total"] += 1
+            stats["frames_skipped_stride"] += 1
+        if not grabbed:
             break
-        if frame is None:
+
+        slot = buffer[count] if buffer is not None else None
+        ret, frame = cap.read(slot) if slot is not None else cap.read()
+        if not ret or frame is None:
             break
+        stats["frames_total"] += 1
         if len(frame.shape) == 3 and frame.shape[2] == 4:
             frame = cv2.cvtColor(frame, cv2.COLOR_BGRA2BGR)
 
+        if gate is not None and not gate.has_motion(frame):
+            stats["frames_skipped_motion"] += 1
+            continue
+
+        if buffer is None:
+            # Allocate once the frame size is known
+            buffer = np.empty((batch_size,) + frame.shape, dtype=frame.dtype)
+            slot = buffer[count]
+        if frame.ctypes.data != slot.ctypes.data:
+            if frame.shape != buffer.shape[1:]:
+                print("Video frame size changed, skipping frame")
+                continue
+            buffer[count] = frame
+        indices.append(offset + stats["frames_total"] - 1)
+        count += 1
+    return buffer, count, indices
+
+
+def detect_video(
+    video_path,
+    batch_size=VIDEO_BATCH_SIZE,
+    stride=VIDEO_FRAME_STRIDE,
+    motion_gate=True,
+    cascade=CASCADE_ENABLED,
+    sink=None,
+    progress=None,
+    prefetch=VIDEO_PREFETCH_BATCHES,
+    source="video",
+):
+    """
+    Detect helmet violations in a video file
+
+    Args:
+        video_path (str): Path to the video
+        batch_size (int): Frames sent to each model call at once
+            (1 = one frame at a time)
+        stride (int): Only every stride-th frame is decoded and analysed
+        motion_gate (bool): Skip inference on frames without motion
+        cascade (bool): Run the helmet model only on rider crops
+        sink (ViolationSink): Where confirmed violations go; a new sink is
+            created (and flushed on return) when not given
+        progress (callable): Called with the stats dict after every batch
+        prefetch (int): Batch buffers shared by the decode, inference and
+            annotate stages (at least 2)
+        source (str): Source name for the ROI / inference size settings
+            (see roi.py), metric labels and recorded violations
+
+    Returns:
+        dict: Frame counters (total, inferred, skipped by stride / motion)
+            and the number of violations recorded
+
+    Raises:
+        IOError: If the video cannot be opened or no frame can be decoded
+    """
+    batch_size = max(1, int(batch_size))
+    stride = max(1, int(stride))
+    gate = MotionGate() if motion_gate else None
+    tracker = ViolationTracker()
+    stats = _new_stats()
+    own_sink = sink is None
+    if own_sink:
+        sink = ViolationSink(name=source)
+
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        cap.release()
+        if own_sink:
+            sink.close()
+        raise IOError(f"Could not open video: {video_path}")
+    stats["frames_expected"] = max(0, int(cap.get(cv2.CAP_PROP_FRAME_COUNT)))
+    rate = RateMeter(source)
+    settings = get_source_settings(source)
+    counted = {}
+
+    # Decode -> inference -> annotate run concurrently. A fixed ring of
+    # batch buffers circulates between them, so at most `prefetch` batches
+    # are in memory whatever the relative stage speeds.
+    free = queue.Queue()
+    for _ in range(max(2, int(prefetch))):
+        free.put([None])
+    decoded = queue.Queue()
+    inferred = queue.Queue()
+    stop = threading.Event()
+    errors = []
+
+    decoder = threading.Thread(
+        target=_decode_stage,
+        args=(cap, free, decoded, batch_size, stride, gate, stats, stop, errors),
+        name="video-decode",
+        daemon=True,
+    )
+    annotator = threading.Thread(
+        target=_annotate_stage,
+        args=(inferred, free, tracker, sink, stats, errors),
+        name="video-annotate",
+        daemon=True,
+    )
+    decoder.start()
+    annotator.start()
+
+    try:
+        while True:
+            item = decoded.get()
+            if item is _END:
+                break
+            slot, count, indices = item
+            frames = [slot[0][i] for i in range(count)]
+
+            try:
+                # Person + Bike detection, then helmet detection
+                # (on rider crops only in cascade mode)
+                detections = detect(frames, settings, cascade=cascade)
+            except Exception as e:
+                print("Video detection model error:", e)
+                free.put(slot)
+                continue
+            stats["frames_inferred"] += count
+
+            # Annotated in frame order on the annotate thread
+            inferred.put((slot, frames, indices, detections))
+
+            _count_frames(source, stats, counted)
+            rate.add(count)
+            if progress is not None:
+                progress(stats)
+    finally:
+        stop.set()
+        free.put(_END)
+        decoder.join()
+        inferred.put(_END)
+        annotator.join()
+        cap.release()
+        _count_frames(source, stats, counted)
+        for e in errors:
+            print("Video pipeline error:", e)
+
+        # Violations still held by their tracks, also when detection was
+        # aborted (e.g. by a failing progress callback)
+        for event in tracker.flush():
+            sink.submit(event)
+            stats["violations"] += 1
+        if own_sink:
+            sink.close()
+    if stats["frames_total"] == 0 and stats["frames_expected"] > 0:
+        raise IOError(f"No frames could be decoded from: {video_path}")
+
+    stats["frames_skipped"] = (
+        stats["frames_skipped_stride"] + stats["frames_skipped_motion"]
+    )
+    print(
+        "Video processed: {frames_total} frames, {frames_inferred} inferred, "
+        "{frames_skipped} skipped".format(**stats)
+    )
+    return stats
+
+
+def _decode_stage(cap, free, decoded, batch_size, stride, gate, stats, stop, errors):
+    # Fills free ring slots with decoded batches until the video ends
+    try:
+        while not stop.is_set():
+            slot = free.get()
+            if slot is _END:
+                return
+            with STAGE_SECONDS.time("decode"):
+                slot[0], count, indices = _read_batch(
+                    cap, slot[0], batch_size, stride, gate, stats
+                )
+            if count == 0:
+                return
+            decoded.put((slot, count, indices))
+            if count < batch_size:
+                return
+    except Exception as e:
+        errors.append(e)
+    finally:
+        decoded.put(_END)
+
+
+def _annotate_stage(inferred, free, tracker, sink, stats, errors):
+    # Draws, tracks and records violations, then hands the slot back
+    while True:
+        item = inferred.get()
+        if item is _END:
+            return
+        slot, frames, indices, detections = item
         try:
-            # Person + Bike detection
-            pb_results = pb_model(frame)
-            # Helmet detection
-            helmet_results = helmet_model(frame)
+            with STAGE_SECONDS.time("postprocess"):
+                for frame, frame_index, (persons, bikes, no_helmets) in zip(
+                    frames, indices, detections
+                ):
+                    stats["violations"] += _process_detections(
+                        frame, persons, bikes, no_helmets, tracker, frame_index, sink
+                    )
         except Exception as e:
-            print("Video detection model error:", e)
-            continue
+            errors.append(e)
+        finally:
+            free.put(slot)
+
+
+def draw_detections(frame, persons, bikes, no_helmets):
+    """
+    Draw bike, person and no-helmet boxes on the frame (in place)
+    """
+    # Draw bikes (red)
+    for bx1, by1, bx2, by2 in bikes.xyxy.tolist():
+        cv2.rectangle(frame, (bx1, by1), (bx2, by2), (0, 0, 255), 2)
+        cv2.putText(
+            frame,
+            "BIKE",
+            (bx1, by1 - 10),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            0.6,
+            (0, 0, 255),
+            2,
+        )
+
+    # Draw persons (cyan)
+    for px1, py1, px2, py2 in persons.xyxy.tolist():
+        cv2.rectangle(frame, (px1, py1), (px2, py2), (255, 255, 0), 2)
+        cv2.putText(
+            frame,
+            "PERSON",
+            (px1, py1 - 10),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            0.6,
+            (255, 255, 0),
+            2,
+        )
+
+    # Draw no-helmet detections (red)
+    for nhx1, nhy1, nhx2, nhy2 in no_helmets.xyxy.tolist():
+        cv2.rectangle(frame, (nhx1, nhy1), (nhx2, nhy2), (0, 0, 255), 3)
+        cv2.putText(
+            frame,
+            "NO HELMET",
+            (nhx1, nhy1 - 10),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            0.8,
+            (0, 0, 255),
+            2,
+        )
+
+
+def _process_detections(
+    frame,
+    persons,
+    bikes,
+    no_helmets,
+    tracker,
+    frame_index,
+    sink,
+    block=True,
+    draw=not DETECTIONS_ONLY,
+    source=None,
+):
+    # In detections-only mode the frame stays clean and the boxes travel
+    # with the violation event (rendered later, see overlay.py)
+    if draw:
+        draw_detections(frame, persons, bikes, no_helmets)
+
+    # HELMET VIOLATION: Person riding bike without helmet
+    riders, violations = match_riders(persons, bikes, no_helmets)
+    if draw and any(v is not None for v in violations):
+        # Draw violation label on the frame
+        cv2.putText(
+            frame,
+            "VIOLATION DETECTED",
+            (50, 50),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            1.5,
+            (0, 0, 255),
+            3,
+        )
 
-        persons = []
-        bikes = []
-        no_helmets = []
-
-        # ================================
-        # PERSON + BIKE DETECTION (yolov8n)
-        # ================================
-        for box in pb_results[0].boxes:
-            cls = int(box.cls[0])
-            label = pb_model.names[cls].lower()
-            conf = float(box.conf[0])
-            xyxy = _xyxy_from_box(box)
-            x1, y1, x2, y2 = [int(v) for v in xyxy]
-
-            if "person" in label:
-                persons.append({"xy": (x1, y1, x2, y2), "conf": conf})
-            elif any(
-                k in label for k in ("motorbike", "motorcycle", "bicycle", "bike")
-            ):
-                bikes.append({"xy": (x1, y1, x2, y2), "conf": conf})
-
-        # ================================
-        # HELMET DETECTION (best.pt)
-        # ================================
-        for box in helmet_results[0].boxes:
-            cls = int(box.cls[0])
-            label = helmet_model.names[cls].lower()
-            conf = float(box.conf[0])
-            xyxy = _xyxy_from_box(box)
-            x1, y1, x2, y2 = [int(v) for v in xyxy]
-
-            if "without helmet" in label or "no helmet" in label:
-                no_helmets.append({"xy": (x1, y1, x2, y2), "conf": conf})
-
-        # Draw bikes (red)
-        for b in bikes:
-            bx1, by1, bx2, by2 = b["xy"]
-            cv2.rectangle(frame, (bx1, by1), (bx2, by2), (0, 0, 255), 2)
-            cv2.putText(
-                frame,
-                "BIKE",
-                (bx1, by1 - 10),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                0.6,
-                (0, 0, 255),
-                2,
-            )
-
-        # Draw persons (cyan)
-        for p in persons:
-            px1, py1, px2, py2 = p["xy"]
-            cv2.rectangle(frame, (px1, py1), (px2, py2), (255, 255, 0), 2)
-            cv2.putText(
-                frame,
-                "PERSON",
-                (px1, py1 - 10),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                0.6,
-                (255, 255, 0),
-                2,
-            )
-
-        # Draw no-helmet detections (red)
-        for nh in no_helmets:
-            nhx1, nhy1, nhx2, nhy2 = nh["xy"]
-            cv2.rectangle(frame, (nhx1, nhy1), (nhx2, nhy2), (0, 0, 255), 3)
-            cv2.putText(
-                frame,
-                "NO HELMET",
-                (nhx1, nhy1 - 10),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                0.8,
-                (0, 0, 255),
-                2,
-            )
-            nh_cx = (nhx1 + nhx2) // 2
-            nh_cy = (nhy1 + nhy2) // 2
-
-            # Check if no-helmet person is in a bike
-            for p in persons:
-                px1, py1, px2, py2 = p["xy"]
-                person_cx = (px1 + px2) // 2
-                person_cy = (py1 + py2) // 2
-
-                # Check if person overlaps with no-helmet detection
-                if px1 <= nh_cx <= px2 and py1 <= nh_cy <= py2:
-                    # Check if person is riding a bike
-                    riding = False
-                    for b in bikes:
-                        bx1, by1, bx2, by2 = b["xy"]
-                        if bx1 <= person_cx <= bx2 and by1 <= person_cy <= by2:
-                            riding = True
-                            break
-
-                    # HELMET VIOLATION: Person riding bike without helmet
-                    if riding and p["conf"] > 0.5:
-                        from notification_email import send_violation_email
-                        from datetime import datetime
-
-                        # Draw violation label on the frame
-                        cv2.putText(
-                            frame,
-                            "VIOLATION DETECTED",
-                            (50, 50),
-                            cv2.FONT_HERSHEY_SIMPLEX,
-                            1.5,
-                            (0, 0, 255),
-                            3,
-                        )
-
-                        timestamp = int(time.time())
-                        violation_filename = f"violation_{timestamp}.jpg"
-                        saved = cv2.imwrite(
-                            os.path.join(VIOLATION_FOLDER, violation_filename), frame
-                        )
-                        if not saved:
-                            print(
-                                "Failed to write violation image:", violation_filename
-                            )
-                            continue
-
-                        conn = get_connection()
-                        try:
-                            cursor = conn.cursor()
-                            cursor.execute(
-                                "INSERT INTO no_helmet_records (image_name, original_image, violation_image, fine_amount, timestamp) VALUES (%s, %s, %s, %s, NOW())",
-                                (
-                                    violation_filename,
-                                    violation_filename,
-                                    violation_filename,
-                                    500,
-                                ),
-                            )
-                            conn.commit()
-
-                            # Send email notification
-                            admin_email = os.environ.get(
-                                "ADMIN_EMAIL", "22r91a1235@tkrec.ac.in"
-                            )
-                            violation_details = {
-                                "timestamp": datetime.now().strftime(
-                                    "%Y-%m-%d %H:%M:%S"
-                                ),
-                                "fine_amount": 500,
-                                "image": violation_filename,
-                            }
-                            send_violation_email(admin_email, violation_details)
-                        except Exception as e:
-                            print("DB insert error in video_detect:", e)
-                        finally:
-                            try:
-                                cursor.close()
-                            except:
-                                pass
-                            try:
-                                conn.close()
-                            except:
-                                pass
-
-    cap.release()
+    # Each rider is recorded once, after the tracker confirms the violation
+    # (image encoding, DB insert and email happen on the sink's threads)
+    detections = None if draw else (persons, bikes, no_helmets)
+    events = tracker.update(riders, violations, frame, frame_index, detections)
+    for event in events:
+        if source is not None:
+            # Camera name for the rollups (defaults to the sink name)
+            event["source"] = source
+        sink.submit(event, block=block)
+    return len(events)
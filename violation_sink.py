@@ -0,0 +1,304 @@
+"""
+Violation Sink
+Background stage that takes confirmed violations off the detection loop:
+images are encoded and written by worker threads, database rows are
+inserted in batches (together with their hourly / daily rollup counts)
+and alert emails are sent after each batch commits. Rows are inserted in
+the order the violations were submitted, whichever encoder finished first,
+so row ids follow detection time.
+"""
+
+from db_connection import db_cursor
+from thumbnails import make_thumbnail, thumbnail_path
+from rollups import add_to_rollups
+from overlay import sidecar_path, to_sidecar, write_sidecar
+from metrics import Counter, Gauge, STAGE_SECONDS, VIOLATIONS
+from datetime import datetime
+import threading
+import weakref
+import queue
+import time
+import numpy as np
+import cv2
+import os
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+VIOLATION_FOLDER = os.path.join(BASE_DIR, "static", "violations")
+
+FINE_AMOUNT = 500
+
+# Violations waiting to be encoded before submit() blocks / drops
+SINK_QUEUE_SIZE = int(os.environ.get("SINK_QUEUE_SIZE", "64"))
+# Rows per executemany batch
+SINK_BATCH_SIZE = int(os.environ.get("SINK_BATCH_SIZE", "20"))
+# Max seconds a row waits before its batch is flushed
+SINK_FLUSH_SECONDS = float(os.environ.get("SINK_FLUSH_SECONDS", "2.0"))
+# Image encoding threads
+SINK_ENCODE_WORKERS = int(os.environ.get("SINK_ENCODE_WORKERS", "2"))
+# Tries per batch insert before its rows (and their images) are dropped
+SINK_INSERT_ATTEMPTS = int(os.environ.get("SINK_INSERT_ATTEMPTS", "4"))
+# Wait before the first insert retry, doubled for each further one
+SINK_RETRY_SECONDS = float(os.environ.get("SINK_RETRY_SECONDS", "0.5"))
+
+INSERT_SQL = (
+    "INSERT INTO no_helmet_records "
+    "(image_name, original_image, violation_image, fine_amount, timestamp, source) "
+    "VALUES (%s, %s, %s, %s, %s, %s)"
+)
+
+_STOP = object()
+
+_sinks = weakref.WeakSet()
+
+SINK_QUEUE_DEPTH = Gauge(
+    "helmettrack_sink_queue_depth",
+    "Violations waiting to be encoded, per sink",
+    ("sink",),
+    callback=lambda: {(sink.name,): sink.qsize() for sink in list(_sinks)},
+)
+SINK_DROPPED = Counter(
+    "helmettrack_sink_dropped_total", "Violations dropped on a full sink", ("sink",)
+)
+
+
+class ViolationSink:
+    """
+    Usage:
+        with ViolationSink() as sink:
+            sink.submit(event)   # event from tracker.ViolationTracker
+    """
+
+    def __init__(
+        self,
+        folder=VIOLATION_FOLDER,
+        queue_size=SINK_QUEUE_SIZE,
+        batch_size=SINK_BATCH_SIZE,
+        flush_seconds=SINK_FLUSH_SECONDS,
+        encode_workers=SINK_ENCODE_WORKERS,
+        send_email=True,
+        name="sink",
+        insert_attempts=SINK_INSERT_ATTEMPTS,
+        retry_seconds=SINK_RETRY_SECONDS,
+    ):
+        self.folder = folder
+        self.batch_size = max(1, int(batch_size))
+        self.flush_seconds = flush_seconds
+        self.insert_attempts = max(1, int(insert_attempts))
+        self.retry_seconds = retry_seconds
+        self.send_email = send_email
+        self.name = name
+        self.dropped = 0
+        self.written = 0
+
+        os.makedirs(self.folder, exist_ok=True)
+
+        self._events = queue.Queue(maxsize=max(1, int(queue_size)))
+        # (sequence number, row or None) from the encoders
+        self._rows = queue.Queue()
+        self._take_lock = threading.Lock()
+        self._taken = 0
+        self._encoders = [
+            threading.Thread(
+                target=self._encode_loop, name=f"{name}-encode-{i}", daemon=True
+            )
+            for i in range(max(1, int(encode_workers)))
+        ]
+        self._writer = threading.Thread(
+            target=self._write_loop, name=f"{name}-writer", daemon=True
+        )
+        for thread in self._encoders:
+            thread.start()
+        self._writer.start()
+        self._closed = False
+        _sinks.add(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def qsize(self):
+        return self._events.qsize()
+
+    def submit(self, event, block=True, timeout=None):
+        """
+        Queue a violation event
+
+        Args:
+            event (dict): Must contain "frame" (BGR image) or "jpeg"
+                (encoded bytes) and "track_id"; "source" (camera name)
+                defaults to the sink name
+            block (bool): Wait for space when the queue is full; when False
+                the event is dropped instead (realtime mode)
+
+        Returns:
+            bool: False if the event was dropped
+        """
+        event = dict(event)
+        event.setdefault("detected_at", datetime.now())
+        try:
+            self._events.put(event, block=block, timeout=timeout)
+            VIOLATIONS.inc(self.name)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            SINK_DROPPED.inc(self.name)
+            print("Violation sink full, dropping violation")
+            return False
+
+    def close(self):
+        """
+        Flush everything still queued and stop the worker threads
+        """
+        if self._closed:
+            return
+        self._closed = True
+        for _ in self._encoders:
+            self._events.put(_STOP)
+        for thread in self._encoders:
+            thread.join()
+        self._rows.put(_STOP)
+        self._writer.join()
+
+    # -------------------------
+    # WORKERS
+    # -------------------------
+    def _encode_loop(self):
+        while True:
+            # Numbered in queue order; the writer restores that order
+            with self._take_lock:
+                event = self._events.get()
+                if event is _STOP:
+                    return
+                seq = self._taken
+                self._taken += 1
+            row = None
+            try:
+                row = self._encode(event)
+            except Exception as e:
+                print("Violation image error:", e)
+            # Failures are passed on too, so the writer never waits for them
+            self._rows.put((seq, row))
+
+    def _encode(self, event):
+        detected_at = event["detected_at"]
+        stamp = detected_at.strftime("%Y%m%d%H%M%S%f")
+        filename = f"violation_{stamp}_{event.get('track_id', 0)}.jpg"
+
+        # Events from other processes arrive already JPEG-encoded
+        data = event.get("jpeg")
+        frame = event.get("frame")
+        if data is None:
+            with STAGE_SECONDS.time("image_encode"):
+                ok, encoded = cv2.imencode(".jpg", frame)
+            if not ok:
+                print("Failed to encode violation image:", filename)
+                return None
+            data = encoded.tobytes()
+        path = os.path.join(self.folder, filename)
+        with open(path, "wb") as f:
+            f.write(data)
+
+        # Clean frame from detections-only mode: keep its boxes beside it
+        if event.get("detections") is not None:
+            write_sidecar(
+                path,
+                to_sidecar(
+                    event["detections"],
+                    event.get("frame_index"),
+                    event.get("track_id"),
+                    event.get("violation"),
+                ),
+            )
+
+        # Listing preview, made from the frame already in memory
+        if frame is None:
+            frame = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+        make_thumbnail(path, frame)
+
+        source = event.get("source") or self.name
+        return (filename, filename, filename, FINE_AMOUNT, detected_at, source)
+
+    def _write_loop(self):
+        batch = []
+        deadline = None
+        pending = {}
+        next_seq = 0
+        while True:
+            timeout = (
+                None if deadline is None else max(0.0, deadline - time.monotonic())
+            )
+            try:
+                item = self._rows.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is _STOP:
+                self._flush(batch)
+                return
+            if item is not None:
+                pending[item[0]] = item[1]
+                while next_seq in pending:
+                    row = pending.pop(next_seq)
+                    next_seq += 1
+                    if row is not None:
+                        batch.append(row)
+                if batch and deadline is None:
+                    deadline = time.monotonic() + self.flush_seconds
+
+            if batch and (
+                len(batch) >= self.batch_size or time.monotonic() >= deadline
+            ):
+                self._flush(batch)
+                batch = []
+                deadline = None
+
+    def _flush(self, rows):
+        if not rows:
+            return
+
+        for attempt in range(self.insert_attempts):
+            try:
+                with db_cursor(commit=True) as cursor:
+                    cursor.executemany(INSERT_SQL, rows)
+                    add_to_rollups(cursor, [(row[4], row[5], row[3]) for row in rows])
+                break
+            except Exception as e:
+                if attempt + 1 < self.insert_attempts:
+                    print("DB insert error in violation sink, retrying:", e)
+                    time.sleep(self.retry_seconds * (2**attempt))
+                    continue
+                print(f"DB insert error in violation sink ({len(rows)} rows lost):", e)
+                # No row points at these files any more
+                for row in rows:
+                    self._remove_files(row[0])
+                return
+        self.written += len(rows)
+
+        if self.send_email:
+            self._notify(rows)
+
+    def _remove_files(self, filename):
+        path = os.path.join(self.folder, filename)
+        for file_path in (path, thumbnail_path(path), sidecar_path(path)):
+            try:
+                os.remove(file_path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print("Could not remove violation file:", e)
+
+    def _notify(self, rows):
+        from notification_email import notify_violation
+
+        admin_email = os.environ.get("ADMIN_EMAIL", "22r91a1235@tkrec.ac.in")
+        for filename, _, _, fine_amount, detected_at, _ in rows:
+            violation_details = {
+                "timestamp": detected_at.strftime("%Y-%m-%d %H:%M:%S"),
+                "fine_amount": fine_amount,
+                "image": filename,
+            }
+            notify_violation(
+                admin_email, violation_details, os.path.join(self.folder, filename)
+            )